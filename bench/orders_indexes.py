@@ -0,0 +1,254 @@
+"""
+Бенчмарк индексов таблицы orders (ORDERS_INDEXES в src/storage/storage.py).
+
+Заполняет базу заказами и замеряет запросы Sqlite3Storage по таблице orders без индексов
+и с ними: захват готовых заказов, страницы и счетчик старых заказов, выборку для архивации
+и возврат заказов с истекшей арендой.
+
+Индексы и условия выборок читаются из storage.py (без импорта плагина и его зависимостей),
+тексты запросов повторяют методы, указанные в QUERIES. Запросы UPDATE откатываются
+после каждого прогона.
+
+    python bench/orders_indexes.py
+    python bench/orders_indexes.py --sizes 10000 100000 --runs 5
+"""
+
+from __future__ import annotations
+
+import os
+import ast
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+from collections.abc import Iterator
+
+
+STORAGE_PATH = Path(__file__).resolve().parent.parent / 'src' / 'storage' / 'storage.py'
+STORAGE_CONSTANTS = (
+    'READY_ORDERS_CONDITION',
+    'EXPIRED_LEASES_CONDITION',
+    'OLD_ORDERS_CONDITION',
+    'ARCHIVABLE_CONDITION',
+    'ORDERS_INDEXES',
+)
+
+
+def _storage_constants() -> dict[str, object]:
+    tree = ast.parse(STORAGE_PATH.read_text(encoding='utf-8'))
+    nodes = [
+        node
+        for node in tree.body
+        if isinstance(node, ast.Assign)
+        and any(isinstance(i, ast.Name) and i.id in STORAGE_CONSTANTS for i in node.targets)
+    ]
+    namespace: dict[str, object] = {}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), str(STORAGE_PATH), 'exec'), namespace)
+    return {i: namespace[i] for i in STORAGE_CONSTANTS}
+
+
+_constants = _storage_constants()
+READY_ORDERS_CONDITION: str = _constants['READY_ORDERS_CONDITION']
+EXPIRED_LEASES_CONDITION: str = _constants['EXPIRED_LEASES_CONDITION']
+OLD_ORDERS_CONDITION: str = _constants['OLD_ORDERS_CONDITION']
+ARCHIVABLE_CONDITION: str = _constants['ARCHIVABLE_CONDITION']
+ORDERS_INDEXES: dict[str, str] = _constants['ORDERS_INDEXES']
+
+# Схема orders после всех миграций (без триггеров: они не влияют на план запросов).
+ORDERS_TABLE = """
+CREATE TABLE "orders" (
+    "order_id"            TEXT    NOT NULL UNIQUE,
+    "hub_instance"        TEXT    NOT NULL,
+    "status"              TEXT    NOT NULL,
+    "error"               TEXT,
+    "retries_left"        INTEGER NOT NULL,
+    "funpay_chat_id"      INTEGER NOT NULL,
+    "telegram_username"   TEXT,
+    "recipient_id"        TEXT,
+    "fragment_request_id" TEXT,
+    "ref"                 TEXT,
+    "in_msg_hash"         TEXT,
+    "transaction_hash"    TEXT,
+    "message_obj"         BLOB    NOT NULL,
+    "order_preview"       BLOB    NOT NULL,
+    "lease_owner"         TEXT,
+    "lease_expires_at"    REAL,
+    "updated_at"          REAL,
+    "stars_amount"        INTEGER,
+    "ton_amount"          INTEGER,
+    "version"             INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY("order_id")
+);
+"""
+
+# 90% DONE / 5% FORCE_DONE / 4% ERROR / 1% остальные статусы.
+STATUSES = (
+    ('DONE', 90),
+    ('FORCE_DONE', 5),
+    ('ERROR', 4),
+    ('READY', 0.2),
+    ('UNPROCESSED', 0.2),
+    ('WAITING_FOR_USERNAME', 0.2),
+    ('PREPARING_TRANSFER', 0.2),
+    ('TRANSFERRING', 0.2),
+)
+
+CURRENT_INSTANCE = 'instance-0'
+HISTORY = 30 * 24 * 60 * 60
+NOW = time.time()
+
+
+def _rows(amount: int, instances: int, rnd: random.Random) -> Iterator[tuple]:
+    statuses, weights = zip(*STATUSES)
+    for i in range(amount):
+        status = rnd.choices(statuses, weights)[0]
+        message = json.dumps(
+            {
+                'id': i,
+                'chat_id': rnd.randrange(10**9),
+                'text': 'x' * rnd.randint(400, 600),
+            },
+        )
+        preview = json.dumps(
+            {
+                'id': f'{i:08X}',
+                'title': f'{rnd.choice((50, 100, 500, 1000))} звёзд, По username, 1 шт.',
+                'counterparty': {'username': f'buyer{rnd.randrange(10**6)}'},
+                'description': 'y' * rnd.randint(400, 600),
+            },
+            ensure_ascii=False,
+        )
+        leased = status == 'PREPARING_TRANSFER'
+        yield (
+            f'{i:08X}',
+            f'instance-{rnd.randrange(instances)}',
+            status,
+            rnd.randint(0, 3) if status == 'ERROR' else 3,
+            rnd.randrange(10**9),
+            f'user{i}',
+            message,
+            preview,
+            f'worker-{rnd.randrange(instances)}' if leased else None,
+            NOW + rnd.uniform(-300, 300) if leased else None,
+            NOW - rnd.uniform(0, HISTORY),
+        )
+
+
+def fill(path: str, amount: int, instances: int, seed: int) -> None:
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL;')
+    conn.execute(ORDERS_TABLE)
+    rows = _rows(amount, instances, rnd)
+    while chunk := [row for _, row in zip(range(10_000), rows)]:
+        conn.executemany(
+            'INSERT INTO orders (order_id, hub_instance, status, retries_left, funpay_chat_id, '
+            'telegram_username, message_obj, order_preview, lease_owner, lease_expires_at, '
+            'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            chunk,
+        )
+    conn.commit()
+    conn.close()
+
+
+# Имя -> (метод Sqlite3Storage, запрос, параметры).
+QUERIES: dict[str, tuple[str, str, tuple]] = {
+    'claim': (
+        'claim_ready_orders',
+        "UPDATE orders SET status = 'PREPARING_TRANSFER', version = version + 1, "
+        'retries_left = retries_left - 1, lease_owner = ?, lease_expires_at = ? '
+        'WHERE order_id IN ('
+        f'SELECT order_id FROM orders WHERE {READY_ORDERS_CONDITION} '
+        'AND hub_instance = ? '
+        'AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires_at <= ?) '
+        'LIMIT ?'
+        ') RETURNING *',
+        ('bench', NOW + 120, CURRENT_INSTANCE, 'bench', NOW, 65),
+    ),
+    'old page': (
+        'get_old_orders_page',
+        f'SELECT * FROM orders WHERE {OLD_ORDERS_CONDITION} AND hub_instance != ? '
+        'AND status = ? AND order_id > ? ORDER BY order_id ASC LIMIT ?',
+        (CURRENT_INSTANCE, 'ERROR', '00000100', 50),
+    ),
+    'old count': (
+        'count_old_orders',
+        f'SELECT COUNT(*) FROM orders WHERE {OLD_ORDERS_CONDITION} AND hub_instance != ? '
+        'AND status = ?',
+        (CURRENT_INSTANCE, 'ERROR'),
+    ),
+    'archive select': (
+        'archive_orders',
+        f'SELECT order_id FROM orders WHERE {ARCHIVABLE_CONDITION} AND updated_at <= ? LIMIT ?',
+        (NOW - 7 * 24 * 60 * 60, 200),
+    ),
+    'expired leases': (
+        'recover_expired_leases',
+        "UPDATE orders SET status = 'READY', version = version + 1, "
+        'lease_owner = NULL, lease_expires_at = NULL '
+        f'WHERE {EXPIRED_LEASES_CONDITION} RETURNING order_id',
+        (NOW,),
+    ),
+}
+
+
+def measure(conn: sqlite3.Connection, query: str, args: tuple, runs: int) -> float:
+    def run() -> None:
+        conn.execute(query, args).fetchall()
+        if conn.in_transaction:
+            conn.rollback()
+
+    run()  # прогрев кэша страниц
+    started = time.perf_counter()
+    for _ in range(runs):
+        run()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def bench(path: str, runs: int) -> dict[str, tuple[float, float]]:
+    conn = sqlite3.connect(path)
+    before = {name: measure(conn, *query[1:], runs) for name, query in QUERIES.items()}
+    for sql in ORDERS_INDEXES.values():
+        conn.execute(sql)
+    conn.commit()
+    after = {name: measure(conn, *query[1:], runs) for name, query in QUERIES.items()}
+    conn.close()
+    return {name: (before[name], after[name]) for name in QUERIES}
+
+
+def _table(results: dict[int, dict[str, tuple[float, float]]]) -> str:
+    header = ['orders', *QUERIES]
+    lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    for size, result in results.items():
+        cells = [f'{size:,}', *(f'{a:.2f} -> {b:.2f} ms' for a, b in result.values())]
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--instances', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f'sqlite {sqlite3.sqlite_version}, {args.instances} instances, mean of {args.runs} runs')
+    print(', '.join(f'{name} = {query[0]}' for name, query in QUERIES.items()))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f'orders_{size}.sqlite3')
+            fill(path, size, args.instances, args.seed)
+            results[size] = bench(path, args.runs)
+            timings = (f'{k} {a:.2f} -> {b:.2f} ms' for k, (a, b) in results[size].items())
+            print(f'{size:,}:', ', '.join(timings))
+    print()
+    print(_table(results))
+
+
+if __name__ == '__main__':
+    main()
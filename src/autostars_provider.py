@@ -4,6 +4,7 @@ from typing import TYPE_CHECKING
 
 from autostars.src.ton import Wallet
 from autostars.src.fragment_api import FragmentAPI
+from autostars.src.recipient_cache import RecipientCache
 
 
 if TYPE_CHECKING:
@@ -18,11 +19,13 @@ class AutostarsProvider:
         storage: Storage,
         fragment: FragmentAPI | None = None,
         wallet: Wallet | None = None,
+        recipients: RecipientCache | None = None,
     ):
         self._storage = storage
         self._tonapi = tonapi
         self._fragment = fragment
         self._wallet = wallet
+        self._recipients = recipients if recipients is not None else RecipientCache()
 
     async def change_wallet(self, mnemonic: str) -> Wallet | None:
         self._wallet = await Wallet.from_mnemonics(mnemonic, self) if mnemonic else None
@@ -44,6 +47,10 @@ class AutostarsProvider:
     def fragment(self) -> FragmentAPI | None:
         return self._fragment
 
+    @property
+    def recipients(self) -> RecipientCache:
+        return self._recipients
+
     @property
     def wallet(self) -> Wallet | None:
         return self._wallet
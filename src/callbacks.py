@@ -59,6 +59,10 @@ class Callbacks:
         for i in orders:
             await self.hub.dispatcher.event_entry(events.StarsOrderUsernameCheckFailed(i))
 
+    async def on_orders_ready(self, *orders: StarsOrder) -> None:
+        if self.plugin.transfer_service is not None:
+            self.plugin.transfer_service.notify()
+
     async def on_successful_transaction(self, *orders: StarsOrder) -> None:
         await self.hub.dispatcher.event_entry(events.StarsOrdersPackCompletedEvent(list(orders)))
         for i in orders:
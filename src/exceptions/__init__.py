@@ -71,3 +71,12 @@ class FailedToCreateStarsLink(FragmentAPIError):
         super().__init__(
             _ru('Ошибка при создании ссылки на перевод звезд.'),
         )
+
+
+class OrderVersionConflict(AutostarsPluginException):
+    def __init__(self, order_ids: list[str]) -> None:
+        super().__init__(
+            _ru('Заказы %s были изменены другой задачей, изменения не сохранены.'),
+            ', '.join(order_ids),
+        )
+        self.order_ids = order_ids
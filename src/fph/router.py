@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
+from autostars.src.properties import parse_rps
 
 from funpayhub.app.dispatching import Router
 
@@ -22,8 +23,13 @@ router = Router(name='autostars')
 @router.on_parameter_value_changed(
     lambda parameter, plugin: parameter.path == plugin.properties.wallet.mnemonics.path,
 )
-async def update_wallet(autostars_provider: AutostarsProvider, parameter: StringParameter):
+async def update_wallet(
+    autostars_provider: AutostarsProvider,
+    autostars_service: TransferrerService,
+    parameter: StringParameter,
+):
     await autostars_provider.change_wallet(parameter.value)
+    autostars_service.notify()
 
 
 @router.on_parameter_value_changed(
@@ -35,12 +41,14 @@ async def update_wallet(autostars_provider: AutostarsProvider, parameter: String
 )
 async def update_fragment_api(
     autostars_provider: AutostarsProvider,
+    autostars_service: TransferrerService,
     plugin: LoadedPlugin[AutostarsPlugin, AutostarsProperties],
 ):
     await autostars_provider.change_fragment(
         plugin.properties.wallet.cookies.value,
         plugin.properties.wallet.fragment_hash.value,
     )
+    autostars_service.notify()
 
 
 @router.on_parameter_value_changed(
@@ -57,6 +65,13 @@ async def update_ton_api_token(autostars_provider: AutostarsProvider, parameter:
     autostars_provider.tonapi.token = parameter.value or None
 
 
+@router.on_parameter_value_changed(
+    lambda parameter, plugin: parameter.path == plugin.properties.wallet.ton_api_rps.path
+)
+async def update_ton_api_rps(autostars_provider: AutostarsProvider, parameter: StringParameter):
+    autostars_provider.tonapi.rps = parse_rps(parameter.value)
+
+
 @router.on_funpayhub_stopped()
 async def stop_service(plugin: LoadedPlugin[AutostarsPlugin, AutostarsProperties]):
     await plugin.plugin.transfer_service.stop()
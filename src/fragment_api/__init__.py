@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from typing import TYPE_CHECKING
 
 from autostars.src.fragment_api.methods import (
@@ -12,6 +13,7 @@ from autostars.src.fragment_api.session import Session
 
 if TYPE_CHECKING:
     from autostars.src.fragment_api.types import BuyStarsLink, BuyStarsResponse, RecipientResponse
+    from autostars.src.fragment_api.methods import FragmentMethod
 
 
 class FragmentAPI:
@@ -19,6 +21,7 @@ class FragmentAPI:
         self._cookies = cookies
         self._hash = hash
         self.session = Session()
+        self._in_flight: dict[str, asyncio.Task] = {}
 
     @property
     def cookies(self) -> str:
@@ -29,11 +32,7 @@ class FragmentAPI:
         return self._hash
 
     async def search_stars_recipient(self, username: str) -> RecipientResponse:
-        return await self.session.post(
-            SearchStarsRecipient(query=username),
-            self.cookies,
-            self.hash,
-        )
+        return await self._single_flight(SearchStarsRecipient(query=username))
 
     async def init_buy_stars_request(self, recipient: str, quantity: int = 50) -> BuyStarsResponse:
         return await self.session.post(
@@ -48,3 +47,23 @@ class FragmentAPI:
             self.cookies,
             self.hash,
         )
+
+    async def _single_flight[ReturnT](self, method: FragmentMethod[ReturnT]) -> ReturnT:
+        """
+        Одинаковые одновременные запросы (только для идемпотентных методов)
+        выполняются одним HTTP запросом и получают один и тот же результат.
+        """
+        key = method.model_dump_json()
+        if (task := self._in_flight.get(key)) is None:
+            task = asyncio.create_task(self.session.post(method, self.cookies, self.hash))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        # shield: отмена одного из ожидающих не должна отменять запрос для остальных.
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # ошибку получат ожидающие, здесь - только чтобы asyncio не ругался
@@ -8,7 +8,7 @@ from collections import defaultdict
 
 from funpaybotengine import Router
 from autostars.src.logger import logger
-from autostars.src.exceptions import FragmentResponseError
+from autostars.src.exceptions import FragmentResponseError, OrderVersionConflict
 from autostars.src.types.enums import ErrorTypes, StarsOrderStatus
 from autostars.src.autostars_provider import AutostarsProvider
 
@@ -23,6 +23,7 @@ if TYPE_CHECKING:
     from funpaybotengine.runner import EventsStack
     from autostars.src.callbacks import Callbacks
     from autostars.src.fragment_api import FragmentAPI
+    from autostars.src.recipient_cache import RecipientCache
 
     from funpayhub.app.main import FunPayHub as FPH
 
@@ -39,15 +40,30 @@ _CHECK_USERNAME_ERRORS = {
 }
 
 
+# Ошибки, которые не исправятся сами по себе в ближайшее время.
+_CACHEABLE_USERNAME_ERRORS = {ErrorTypes.USERNAME_NOT_FOUND, ErrorTypes.NOT_USER_USERNAME}
+
+
 CHECKING_ORDER_USERNAMES = set()
 
 
-async def check_username(o: StarsOrder, api: FragmentAPI) -> StarsOrder:
+async def check_username(
+    o: StarsOrder,
+    api: FragmentAPI,
+    recipients: RecipientCache,
+) -> StarsOrder:
+    if (cached := await recipients.get(o.telegram_username)) is not None:
+        if cached.recipient_id:
+            o.status, o.recipient_id = StarsOrderStatus.READY, cached.recipient_id
+        else:
+            o.status, o.error = StarsOrderStatus.WAITING_FOR_USERNAME, cached.error
+        return o
 
     for i in range(3):
         try:
             r = await api.search_stars_recipient(o.telegram_username)
             o.status, o.recipient_id = StarsOrderStatus.READY, r.found.recipient
+            await recipients.add_recipient(o.telegram_username, r.found.recipient)
             return o
         except FragmentResponseError as e:
             o.status = StarsOrderStatus.WAITING_FOR_USERNAME
@@ -55,6 +71,8 @@ async def check_username(o: StarsOrder, api: FragmentAPI) -> StarsOrder:
                 e.error_text.lower(),
                 ErrorTypes.UNABLE_TO_FETCH_USERNAME,
             )
+            if o.error in _CACHEABLE_USERNAME_ERRORS:
+                await recipients.add_error(o.telegram_username, o.error)
             return o
         except Exception:
             logger.warning('Ошибка проверки @%s (%d).', o.telegram_username, i + 1, exc_info=True)
@@ -85,12 +103,24 @@ async def check_usernames(orders: list[StarsOrder], provider: AutostarsProvider,
         else:
             to_check.append(order)
 
-    r = await asyncio.gather(*(check_username(i, provider.fragment) for i in to_check))
+    r = await asyncio.gather(
+        *(check_username(i, provider.fragment, provider.recipients) for i in to_check),
+    )
     for i in r:
         checked[i.status].append(i)
-    await storage.add_or_update_orders(*chain(*checked.values()))
+
+    try:
+        await storage.add_or_update_orders(*chain(*checked.values()), wait=True)
+    except OrderVersionConflict as e:
+        # Заказы изменили во время проверки (например, пометили выполненными) - не трогаем их.
+        logger.warning('Заказы %s изменены во время проверки юзернейма.', e.order_ids)
+        for status, status_orders in checked.items():
+            checked[status] = [i for i in status_orders if i.order_id not in e.order_ids]
     CHECKING_ORDER_USERNAMES.difference_update(order_ids)
 
+    if checked[StarsOrderStatus.READY]:
+        await cbs.on_orders_ready(*checked[StarsOrderStatus.READY])
+
     if checked[StarsOrderStatus.WAITING_FOR_USERNAME]:
         asyncio.create_task(
             cbs.on_username_check_error(*checked[StarsOrderStatus.WAITING_FOR_USERNAME]),
@@ -113,7 +143,14 @@ async def sale_orders(
 
     logger.info(_ru('Добавляю данные о заказах %s в базу данных.'), [i.order_id for i in orders])
 
-    await autostars_provider.storage.add_or_update_orders(*orders)
+    try:
+        await autostars_provider.storage.add_or_update_orders(*orders, wait=True)
+    except OrderVersionConflict as e:
+        # Повторное событие о заказе, который уже сохранен и обрабатывается.
+        logger.warning(_ru('Заказы %s уже есть в базе данных.'), e.order_ids)
+        orders = [i for i in orders if i.order_id not in e.order_ids]
+        if not orders:
+            return
     asyncio.create_task(check_usernames(orders, autostars_provider, autostars_callbacks))
 
 
@@ -133,24 +170,31 @@ async def update_order_username(
     if order_id in CHECKING_ORDER_USERNAMES:
         return
 
-    order = await autostars_provider.storage.get_order(order_id)
-    if not order or order.funpay_chat_id != message.chat_id:
-        return
+    def change(order: StarsOrder) -> bool:
+        if order.funpay_chat_id != message.chat_id:
+            return False
 
-    if order.hub_instance != hub.instance_id and not message.from_me:
-        return
+        if order.hub_instance != hub.instance_id and not message.from_me:
+            return False
 
-    if order.status is not StarsOrderStatus.WAITING_FOR_USERNAME:
-        return
+        if order.status is not StarsOrderStatus.WAITING_FOR_USERNAME:
+            return False
 
-    if len(args) < 2 and order.error not in [
-        ErrorTypes.UNABLE_TO_FETCH_USERNAME,
-        ErrorTypes.BLOCKED_BY_USER,
-    ]:
-        return
+        if len(args) < 2 and order.error not in [
+            ErrorTypes.UNABLE_TO_FETCH_USERNAME,
+            ErrorTypes.BLOCKED_BY_USER,
+        ]:
+            return False
 
-    order.telegram_username = args[1] if len(args) > 1 else order.telegram_username
-    order.status = StarsOrderStatus.WAITING_FOR_USERNAME
+        order.telegram_username = args[1] if len(args) > 1 else order.telegram_username
+        order.status = StarsOrderStatus.WAITING_FOR_USERNAME
+        return True
+
+    try:
+        order = await autostars_provider.storage.modify_order(order_id, change)
+    except OrderVersionConflict:
+        logger.warning(_ru('Не удалось обновить юзернейм заказа %s.'), order_id, exc_info=True)
+        return
 
-    await autostars_provider.storage.add_or_update_orders(order)
-    asyncio.create_task(check_usernames([order], autostars_provider, autostars_callbacks))
+    if order is not None:
+        asyncio.create_task(check_usernames([order], autostars_provider, autostars_callbacks))
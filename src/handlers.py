@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING
 from autostars.src import events
 from autostars.src.other import NotificationChannels
 from autostars.src.logger import logger
+from autostars.src.exceptions import OrderVersionConflict
 from autostars.src.formatters import StarsOrderCategory, StarsOrderFormatterContext
 from autostars.src.telegram.ui.context import OrdersListMenuContext
 from autostars.src.types.enums import ErrorTypes, StarsOrderStatus
@@ -192,7 +193,15 @@ async def bad_username_fp_notification(
 async def refund(stars_order: StarsOrder, autostars_provider: AutostarsProvider, hub: FPH):
     old_status = stars_order.status
     stars_order.status = StarsOrderStatus.REFUNDED
-    await autostars_provider.storage.add_or_update_order(stars_order)
+    try:
+        await autostars_provider.storage.add_or_update_order(stars_order)
+    except OrderVersionConflict:
+        # Заказ успели изменить (например, пометили выполненным вручную) - не возвращаем деньги.
+        logger.warning(
+            _ru('Заказ %s изменен, возврат средств отменен.'),
+            stars_order.order_id,
+        )
+        return
 
     for i in range(3):
         try:
@@ -207,4 +216,7 @@ async def refund(stars_order: StarsOrder, autostars_provider: AutostarsProvider,
             await asyncio.sleep(1)
     else:
         stars_order.status = old_status
-        await autostars_provider.storage.add_or_update_order(stars_order)
+        try:
+            await autostars_provider.storage.add_or_update_order(stars_order)
+        except OrderVersionConflict:
+            logger.warning(_ru('Заказ %s изменен, статус не восстановлен.'), stars_order.order_id)
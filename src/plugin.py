@@ -4,7 +4,6 @@ import time
 import asyncio
 import traceback
 from typing import TYPE_CHECKING, Any
-from itertools import chain
 
 from aiogram.types import BufferedInputFile
 from aiogram.methods import SendDocument
@@ -24,7 +23,7 @@ from .storage import Sqlite3Storage
 from .handlers import router as autostars_internal_router
 from .callbacks import Callbacks
 from .formatters import FORMATTERS, StarsOrderCategory
-from .properties import AutostarsProperties
+from .properties import AutostarsProperties, parse_rps
 from .telegram.ui import BUILDERS
 from .types.enums import (
     ErrorTypes,
@@ -32,6 +31,7 @@ from .types.enums import (
 )
 from .fragment_api import FragmentAPI
 from .telegram.routers import ROUTERS
+from .recipient_cache import RecipientCache
 from .autostars_provider import AutostarsProvider
 from .transferer_service import TransferrerService
 from .telegram.ui.modifications import MODIFICATIONS
@@ -48,7 +48,7 @@ if TYPE_CHECKING:
 
     from funpayhub.app.dispatching import Router as HubRouter
 
-    from .types import StarsOrder
+    from .types import OrderRow
     from .tonapi.types import Transaction
 
 
@@ -131,6 +131,18 @@ class AutostarsPlugin(Plugin):
                 description=ru('[AutoStars] Удалить заказы.'),
                 setup=True,
             ),
+            Command(
+                source=self.manifest.plugin_id,
+                command='stars_stats',
+                description=ru('[AutoStars] Статистика продаж по дням.'),
+                setup=True,
+            ),
+            Command(
+                source=self.manifest.plugin_id,
+                command='stars_export',
+                description=ru('[AutoStars] Выгрузить заказы (CSV / NDJSON).'),
+                setup=True,
+            ),
         ]
 
     async def formatters(self) -> type[Formatter] | list[type[Formatter]] | None:
@@ -149,10 +161,16 @@ class AutostarsPlugin(Plugin):
 
     async def post_setup(self) -> None:
         self.tonapi.token = self.props.wallet.ton_api_token.value or None
-        storage = await Sqlite3Storage.from_path('storage/autostars.sqlite3')
-        self.provider = AutostarsProvider(self.tonapi, storage)
+        self.tonapi.rps = parse_rps(self.props.wallet.ton_api_rps.value)
+        storage = await Sqlite3Storage.from_path('storage/autostars.sqlite3', write_delay=0.1)
+        self.provider = AutostarsProvider(
+            self.tonapi,
+            storage,
+            recipients=RecipientCache(storage),
+        )
 
         await self.check_old_transferring_orders()
+        await self.check_old_preparing_orders()
 
         if self.props.wallet.cookies.value and self.props.wallet.fragment_hash.value:
             self.logger.info(ru('Cookie и Hash найдены в настройках. Создаю FragmentAPI.'))
@@ -237,6 +255,7 @@ class AutostarsPlugin(Plugin):
             instance_id=self.hub.instance_id,
             same_instance=False,
             status=SOS.TRANSFERRING,
+            columns=('in_msg_hash',),
         )
         orders = {i for i in orders_dict.values() if i.in_msg_hash}
         if not orders:
@@ -251,23 +270,19 @@ class AutostarsPlugin(Plugin):
         )
 
         timeout = int(time.time() + 10)  # todo: valid_until from db
-        done: dict[StarsOrder, Transaction] = {}
-        for i in {i.in_msg_hash for i in orders}:
-            try:
-                tr = await self.provider.tonapi.wait_for_transfer(i, timeout)
-                done.update({j: tr for j in orders if j.in_msg_hash == i})
-            except TimeoutError:
-                pass
+        hashes = list({i.in_msg_hash for i in orders})
+        results = await asyncio.gather(
+            *(self.provider.tonapi.wait_for_transfer(i, timeout) for i in hashes),
+            return_exceptions=True,
+        )
 
-        errored = {i for i in orders if i not in done}
-        for order, trans in done.items():
-            order.status = SOS.DONE
-            order.error = None
-            order.transaction_hash = trans.hash
+        done: dict[OrderRow, Transaction] = {}
+        for msg_hash, tr in zip(hashes, results):
+            if isinstance(tr, BaseException):
+                continue
+            done.update({j: tr for j in orders if j.in_msg_hash == msg_hash})
 
-        for order in errored:
-            order.status = SOS.ERROR
-            order.error = ErrorTypes.TRANSACTION_TIMEOUT_ERROR
+        errored = {i for i in orders if i not in done}
 
         notification_parts = ['✅ Проверка незавершенных транзакций завершена.']
         if done:
@@ -286,10 +301,31 @@ class AutostarsPlugin(Plugin):
             text='<b>' + '\n\n'.join(notification_parts) + '</b>',
         )
 
-        await self.provider.storage.add_or_update_orders(*chain(done.keys(), errored))
+        for msg_hash, tr in zip(hashes, results):
+            if not isinstance(tr, BaseException):
+                await self.provider.storage.update_orders(
+                    *(i.order_id for i in orders if i.in_msg_hash == msg_hash),
+                    status=SOS.DONE,
+                    error=None,
+                    transaction_hash=tr.hash,
+                )
+        if errored:
+            await self.provider.storage.update_orders(
+                *(i.order_id for i in errored),
+                status=SOS.ERROR,
+                error=ErrorTypes.TRANSACTION_TIMEOUT_ERROR,
+            )
+
+    async def check_old_preparing_orders(self) -> None:
+        # Заказы прошлых запусков с еще живой арендой вернутся позже, в цикле сервиса.
+        await self.provider.storage.release_old_leases(self.hub.instance_id)
 
     async def check_old_orders(self):
-        orders_dict = await self.provider.storage.get_old_orders(self.hub.instance_id)
+        orders_dict = await self.provider.storage.count_orders_by_status(
+            self.hub.instance_id,
+            same_instance=False,
+            old_only=True,
+        )
         if not orders_dict:
             return
 
@@ -17,6 +17,20 @@ async def mnemonic_validator(val: str) -> None:
         raise ValidationError('Невалидная сид фраза.')
 
 
+def parse_rps(val: str) -> float | None:
+    return float(val.replace(',', '.')) if val.strip() else None
+
+
+async def rps_validator(val: str) -> None:
+    try:
+        rps = parse_rps(val)
+    except ValueError:
+        raise ValidationError('Лимит должен быть числом.')
+
+    if rps is not None and rps <= 0:
+        raise ValidationError('Лимит должен быть больше 0.')
+
+
 class AutostarsProperties(Properties):
     def __init__(self) -> None:
         super().__init__(
@@ -82,6 +96,18 @@ class WalletProperties(Properties):
             )
         )
 
+        self.ton_api_rps = self.attach_node(
+            StringParameter(
+                id='ton_api_rps',
+                name='Лимит запросов к tonapi.io',
+                description='Кол-во запросов в секунду к tonapi.io. '
+                'Если не указано, лимит выбирается по наличию токена.',
+                default_value='',
+                flags=[TelegramUIEmojiFlag('⏱️')],
+                validator=rps_validator,
+            ),
+        )
+
 
 class MessagesProperties(Properties):
     def __init__(self):
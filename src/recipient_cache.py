@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+
+__all__ = ['RecipientCache']
+
+
+import time
+from typing import TYPE_CHECKING
+
+from autostars.src.types import CachedRecipient
+
+
+if TYPE_CHECKING:
+    from autostars.src.storage import Storage
+    from autostars.src.types.enums import ErrorTypes
+
+
+class RecipientCache:
+    """
+    Кэш результатов Fragment searchStarsRecipient по юзернейму.
+
+    Найденные получатели хранятся `ttl` секунд, ошибки вида "не найден" - `negative_ttl` секунд.
+    Если передано хранилище, записи сохраняются в него и переживают перезапуск.
+    """
+
+    def __init__(
+        self,
+        storage: Storage | None = None,
+        ttl: float = 24 * 60 * 60,
+        negative_ttl: float = 60,
+        max_size: int = 10_000,
+    ) -> None:
+        self._storage = storage
+        self._entries: dict[str, CachedRecipient] = {}
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+
+    @staticmethod
+    def normalize(username: str) -> str:
+        return username.strip().lstrip('@').lower()
+
+    async def get(self, username: str) -> CachedRecipient | None:
+        key = self.normalize(username)
+        entry = self._entries.get(key)
+        if entry is None and self._storage is not None:
+            entry = await self._storage.get_recipient(key)
+
+        if entry is None or entry.expired:
+            self._entries.pop(key, None)
+            return None
+
+        self._entries[key] = entry
+        return entry
+
+    async def add_recipient(self, username: str, recipient_id: str) -> None:
+        await self._add(
+            CachedRecipient(
+                username=self.normalize(username),
+                recipient_id=recipient_id,
+                error=None,
+                expires_at=time.time() + self.ttl,
+            ),
+        )
+
+    async def add_error(self, username: str, error: ErrorTypes) -> None:
+        await self._add(
+            CachedRecipient(
+                username=self.normalize(username),
+                recipient_id=None,
+                error=error,
+                expires_at=time.time() + self.negative_ttl,
+            ),
+        )
+
+    async def _add(self, entry: CachedRecipient) -> None:
+        self._entries.pop(entry.username, None)
+        self._entries[entry.username] = entry
+        if len(self._entries) > self.max_size:
+            self._prune()
+
+        if self._storage is not None:
+            await self._storage.save_recipient(entry)
+
+    def _prune(self) -> None:
+        for key in [k for k, v in self._entries.items() if v.expired]:
+            del self._entries[key]
+
+        # Словарь хранит записи в порядке добавления - удаляем самые старые.
+        while len(self._entries) > self.max_size:
+            del self._entries[next(iter(self._entries))]
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 
-__all__ = ['Storage', 'Sqlite3Storage']
+__all__ = ['Storage', 'Sqlite3Storage', 'OrderFilter']
 
 from autostars.src.storage.storage import Storage, Sqlite3Storage
+from autostars.src.storage.order_filter import OrderFilter
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+
+__all__ = ['OrderChange', 'ChangeFeed', 'Subscription']
+
+
+import asyncio
+from typing import Self
+from dataclasses import dataclass
+from collections.abc import Iterable
+
+from autostars.src.logger import logger
+from autostars.src.types.enums import StarsOrderStatus
+
+
+@dataclass(frozen=True)
+class OrderChange:
+    event_id: int
+    order_id: str
+    old_status: StarsOrderStatus | None
+    new_status: StarsOrderStatus
+
+
+class Subscription:
+    """
+    Очередь изменений одного подписчика.
+
+    Если подписчик не успевает читать, самые старые изменения отбрасываются:
+    лента - способ узнать о новых изменениях, а не замена чтения из базы.
+    """
+
+    def __init__(self, feed: ChangeFeed, maxsize: int) -> None:
+        self._feed = feed
+        self._queue: asyncio.Queue[OrderChange] = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, change: OrderChange) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(change)
+
+    async def get(self) -> OrderChange:
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self._feed.unsubscribe(self)
+
+    def __aiter__(self) -> Self:
+        return self
+
+    async def __anext__(self) -> OrderChange:
+        return await self.get()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class ChangeFeed:
+    """
+    Лента изменений статусов заказов внутри процесса.
+    Хранилище публикует изменения после коммита, в порядке записи в `order_events`.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: set[Subscription] = set()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self, maxsize: int = 1000) -> Subscription:
+        subscription = Subscription(self, maxsize)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def publish(self, changes: Iterable[OrderChange]) -> None:
+        for change in changes:
+            for subscription in self._subscribers:
+                subscription.put(change)
+
+        for subscription in self._subscribers:
+            if subscription.dropped:
+                logger.warning(
+                    'Подписчик ленты изменений не успевает, пропущено изменений: %d.',
+                    subscription.dropped,
+                )
+                subscription.dropped = 0
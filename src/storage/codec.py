@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+
+__all__ = [
+    'BlobCodec',
+    'FORMAT_PLAIN',
+    'FORMAT_ZLIB',
+    'FORMAT_ZLIB_DICT',
+]
+
+
+import zlib
+from collections.abc import Iterable
+
+
+# Первый байт закодированного значения - формат.
+FORMAT_PLAIN = 0
+FORMAT_ZLIB = 1
+FORMAT_ZLIB_DICT = 2  # второй байт - ID словаря
+
+
+class BlobCodec:
+    """
+    Кодирует JSON сообщений и превью заказов для хранения в базе.
+
+    Значения начинаются с байта формата, поэтому формат можно менять без перекодирования
+    старых строк. Строки (`TEXT`) считаются JSON, сохраненным до появления кодека.
+
+    Для `FORMAT_ZLIB_DICT` используется общий словарь, собранный из уже сохраненных заказов:
+    на коротких JSON с одинаковыми ключами он сжимает заметно лучше, чем zlib без словаря.
+    Пока словаря нет, значения сжимаются как `FORMAT_ZLIB`.
+    """
+
+    def __init__(self, format: int = FORMAT_ZLIB_DICT, level: int = 6) -> None:
+        if format not in (FORMAT_PLAIN, FORMAT_ZLIB, FORMAT_ZLIB_DICT):
+            raise ValueError(f'Unknown blob format: {format}.')
+
+        self.format = format
+        self.level = level
+        self._dictionaries: dict[int, bytes] = {}
+        self._dictionary_id: int | None = None
+
+    @property
+    def dictionary_id(self) -> int | None:
+        return self._dictionary_id
+
+    def add_dictionary(self, dictionary_id: int, data: bytes) -> None:
+        """
+        Добавляет словарь для декодирования. Для кодирования используется словарь
+        с наибольшим ID.
+        """
+        if not 0 <= dictionary_id <= 255:
+            raise ValueError(f'Dictionary id must fit in one byte, got {dictionary_id}.')
+
+        self._dictionaries[dictionary_id] = data
+        self._dictionary_id = max(self._dictionaries)
+
+    @staticmethod
+    def train_dictionary(samples: Iterable[str], size: int = 32 * 1024) -> bytes:
+        """
+        Собирает словарь из примеров значений.
+        zlib лучше находит совпадения в конце словаря, поэтому свежие примеры идут последними.
+        """
+        data = b''.join(i.encode() for i in samples)
+        return data[-size:]
+
+    def encode(self, value: str) -> bytes:
+        data = value.encode()
+        if self.format == FORMAT_PLAIN:
+            return bytes((FORMAT_PLAIN,)) + data
+
+        if self.format == FORMAT_ZLIB_DICT and self._dictionary_id is not None:
+            compressor = zlib.compressobj(
+                self.level,
+                zdict=self._dictionaries[self._dictionary_id],
+            )
+            return (
+                bytes((FORMAT_ZLIB_DICT, self._dictionary_id))
+                + compressor.compress(data)
+                + compressor.flush()
+            )
+
+        return bytes((FORMAT_ZLIB,)) + zlib.compress(data, self.level)
+
+    def decode(self, value: str | bytes) -> str:
+        if isinstance(value, str):
+            return value
+
+        header = value[0]
+        if header == FORMAT_PLAIN:
+            return value[1:].decode()
+        if header == FORMAT_ZLIB:
+            return zlib.decompress(value[1:]).decode()
+        if header == FORMAT_ZLIB_DICT:
+            decompressor = zlib.decompressobj(zdict=self._dictionaries[value[1]])
+            return (decompressor.decompress(value[2:]) + decompressor.flush()).decode()
+
+        raise ValueError(f'Unknown blob format: {value[0]}.')
+
+    def encode_sql(self, value: str | bytes | None) -> bytes | None:
+        """
+        Функция `encode_blob` для SQL: уже закодированные значения не меняются.
+        """
+        if value is None or isinstance(value, bytes):
+            return value
+        return self.encode(value)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+
+__all__ = ['EXPORT_FORMATS', 'EXPORT_FIELDS', 'export_orders']
+
+
+import csv
+import json
+from typing import TYPE_CHECKING, Any, TextIO, Literal
+
+from autostars.src.logger import logger
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from autostars.src.types import OrderRow
+    from autostars.src.storage.storage import Storage
+    from autostars.src.storage.order_filter import OrderFilter
+
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = (
+    'order_id',
+    'status',
+    'error',
+    'hub_instance',
+    'buyer',
+    'telegram_username',
+    'stars_amount',
+    'ton_amount',
+    'transaction_hash',
+    'updated_at',
+)
+# Поля выгрузки, которых нет среди колонок заказа, и колонки, из которых они берутся.
+_COMPUTED_FIELDS = {'buyer': 'order_preview'}
+
+
+def _export_row(order: OrderRow, fields: Sequence[str]) -> dict[str, Any]:
+    row = {}
+    for i in fields:
+        if i == 'buyer':
+            row[i] = json.loads(order.order_preview)['counterparty']['username']
+        elif i in ('status', 'error'):
+            value = getattr(order, i)
+            row[i] = value.value if value is not None else None
+        else:
+            row[i] = getattr(order, i)
+    return row
+
+
+async def export_orders(
+    storage: Storage,
+    file: TextIO,
+    format: Literal['csv', 'ndjson'] = 'csv',
+    order_filter: OrderFilter | None = None,
+    batch_size: int = 500,
+    fields: Sequence[str] = EXPORT_FIELDS,
+) -> int:
+    """
+    Записывает заказы в `file` построчно, читая их из базы через `iter_orders`.
+    Из базы читаются только колонки выбранных `fields`: превью заказа распаковывается
+    только ради `buyer`.
+    Возвращает количество выгруженных заказов.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format: {format}.')
+    if unknown := [i for i in fields if i not in EXPORT_FIELDS]:
+        raise ValueError(f'Unknown export fields: {", ".join(unknown)}.')
+
+    writer = None
+    if format == 'csv':
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+
+    columns = tuple(dict.fromkeys(_COMPUTED_FIELDS.get(i, i) for i in fields))
+    count = 0
+    async for order in storage.iter_orders(order_filter, batch_size=batch_size, columns=columns):
+        try:
+            row = _export_row(order, fields)
+        except Exception:
+            logger.warning('Не удалось выгрузить заказ %s.', order.order_id, exc_info=True)
+            continue
+
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
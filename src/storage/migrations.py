@@ -0,0 +1,440 @@
+from __future__ import annotations
+
+
+__all__ = ['Migration', 'Migrator', 'MIGRATIONS', 'NOW_SQL', 'STATS_STATUSES']
+
+
+import time
+import asyncio
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+
+from autostars.src.logger import logger
+
+
+if TYPE_CHECKING:
+    from aiosqlite import Connection
+
+
+# Текущее время (unix timestamp) в SQL.
+NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+
+# Статусы, по которым ведется статистика продаж (order_stats).
+# ERROR учитывается один раз на заказ: когда попытки перевода закончились.
+STATS_STATUSES = ('DONE', 'FORCE_DONE', 'ERROR', 'REFUNDED', 'FORCE_REFUNDED')
+STATS_STATUSES_SQL = ', '.join(f"'{i}'" for i in STATS_STATUSES)
+
+
+def _stats_condition(row: str = '') -> str:
+    return (
+        f'({row}"status" IN ({STATS_STATUSES_SQL}) '
+        f'AND ({row}"status" != \'ERROR\' OR {row}"retries_left" <= 0))'
+    )
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    Миграция схемы.
+
+    `statements` выполняются в одной транзакции вместе с записью в `schema_migrations`
+    и обновлением `PRAGMA user_version`.
+
+    `backfill` - запрос, который обновляет не более `:batch_size` строк за раз.
+    Он выполняется в фоне после запуска, пачками в отдельных транзакциях, пока не перестанет
+    изменять строки, поэтому должен сам отбирать еще не обработанные строки.
+    """
+
+    version: int
+    name: str
+    statements: tuple[str, ...] = ()
+    backfill: str | None = None
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        name='create_orders',
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS "orders" (
+                "order_id"            TEXT    NOT NULL UNIQUE,
+                "hub_instance"        TEXT    NOT NULL,
+
+                "status"              TEXT    NOT NULL,
+                "error"               TEXT,
+                "retries_left"        INTEGER NOT NULL,
+
+                "funpay_chat_id"      INTEGER NOT NULL,
+                "telegram_username"   TEXT,
+
+                "recipient_id"        TEXT,
+                "fragment_request_id" TEXT,
+                "ref"                 TEXT,
+                "in_msg_hash"         TEXT,
+                "transaction_hash"    TEXT,
+
+                "message_obj"         TEXT    NOT NULL,
+                "order_preview"       TEXT    NOT NULL,
+                PRIMARY KEY("order_id")
+            );
+            """,
+        ),
+    ),
+    Migration(
+        version=2,
+        name='create_recipients',
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS "recipients" (
+                "username"     TEXT NOT NULL,
+                "recipient_id" TEXT,
+                "error"        TEXT,
+                "expires_at"   REAL NOT NULL,
+                PRIMARY KEY("username")
+            );
+            """,
+        ),
+    ),
+    Migration(
+        version=3,
+        name='add_order_leases',
+        statements=(
+            'ALTER TABLE "orders" ADD COLUMN "lease_owner" TEXT;',
+            'ALTER TABLE "orders" ADD COLUMN "lease_expires_at" REAL;',
+        ),
+    ),
+    Migration(
+        version=4,
+        name='add_orders_archive',
+        statements=(
+            'ALTER TABLE "orders" ADD COLUMN "updated_at" REAL;',
+            f"""
+            CREATE TRIGGER IF NOT EXISTS "orders_touch_on_insert"
+            AFTER INSERT ON "orders"
+            WHEN NEW."updated_at" IS NULL
+            BEGIN
+                UPDATE "orders" SET "updated_at" = {NOW_SQL} WHERE rowid = NEW.rowid;
+            END;
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS "orders_touch_on_status"
+            AFTER UPDATE OF "status" ON "orders"
+            WHEN NEW."status" IS NOT OLD."status"
+            BEGIN
+                UPDATE "orders" SET "updated_at" = {NOW_SQL} WHERE rowid = NEW.rowid;
+            END;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS "orders_archive" (
+                "order_id"            TEXT    NOT NULL,
+                "hub_instance"        TEXT    NOT NULL,
+
+                "status"              TEXT    NOT NULL,
+                "error"               TEXT,
+                "retries_left"        INTEGER NOT NULL,
+
+                "funpay_chat_id"      INTEGER NOT NULL,
+                "telegram_username"   TEXT,
+
+                "recipient_id"        TEXT,
+                "fragment_request_id" TEXT,
+                "ref"                 TEXT,
+                "in_msg_hash"         TEXT,
+                "transaction_hash"    TEXT,
+
+                "message_obj"         BLOB    NOT NULL,
+                "order_preview"       BLOB    NOT NULL,
+
+                "updated_at"          REAL,
+                "archived_at"         REAL    NOT NULL,
+                PRIMARY KEY("order_id")
+            );
+            """,
+        ),
+        backfill=(
+            f'UPDATE "orders" SET "updated_at" = {NOW_SQL} WHERE rowid IN '
+            '(SELECT rowid FROM "orders" WHERE "updated_at" IS NULL LIMIT :batch_size)'
+        ),
+    ),
+    Migration(
+        version=5,
+        name='encode_blobs',
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS "blob_dictionaries" (
+                "id"         INTEGER NOT NULL,
+                "data"       BLOB    NOT NULL,
+                "created_at" REAL    NOT NULL,
+                PRIMARY KEY("id")
+            );
+            """,
+        ),
+        # encode_blob регистрирует Sqlite3Storage (см. BlobCodec).
+        backfill=(
+            'UPDATE "orders" SET '
+            '"message_obj" = encode_blob("message_obj"), '
+            '"order_preview" = encode_blob("order_preview") '
+            'WHERE rowid IN (SELECT rowid FROM "orders" '
+            "WHERE typeof(message_obj) = 'text' OR typeof(order_preview) = 'text' "
+            'LIMIT :batch_size)'
+        ),
+    ),
+    Migration(
+        version=6,
+        name='create_order_events',
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS "order_events" (
+                "id"          INTEGER NOT NULL,
+                "order_id"    TEXT    NOT NULL,
+                "from_status" TEXT,
+                "to_status"   TEXT    NOT NULL,
+                "error"       TEXT,
+                "created_at"  REAL    NOT NULL,
+                "latency"     REAL,
+                PRIMARY KEY("id")
+            );
+            """,
+            'CREATE INDEX IF NOT EXISTS "idx_order_events_order" ON "order_events" ("order_id");',
+            'CREATE INDEX IF NOT EXISTS "idx_order_events_time" ON "order_events" ("created_at");',
+            # События пишутся триггерами, поэтому всегда в той же транзакции, что и смена статуса.
+            f"""
+            CREATE TRIGGER IF NOT EXISTS "order_events_on_insert"
+            AFTER INSERT ON "orders"
+            BEGIN
+                INSERT INTO "order_events" ("order_id", "to_status", "error", "created_at")
+                VALUES (NEW."order_id", NEW."status", NEW."error", {NOW_SQL});
+            END;
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS "order_events_on_status"
+            AFTER UPDATE OF "status" ON "orders"
+            WHEN NEW."status" IS NOT OLD."status"
+            BEGIN
+                INSERT INTO "order_events"
+                    ("order_id", "from_status", "to_status", "error", "created_at", "latency")
+                VALUES (
+                    NEW."order_id",
+                    OLD."status",
+                    NEW."status",
+                    NEW."error",
+                    {NOW_SQL},
+                    {NOW_SQL} - OLD."updated_at"
+                );
+            END;
+            """,
+        ),
+    ),
+    Migration(
+        version=7,
+        name='create_order_stats',
+        statements=(
+            'ALTER TABLE "orders" ADD COLUMN "stars_amount" INTEGER;',
+            'ALTER TABLE "orders" ADD COLUMN "ton_amount" INTEGER;',
+            'ALTER TABLE "orders_archive" ADD COLUMN "stars_amount" INTEGER;',
+            'ALTER TABLE "orders_archive" ADD COLUMN "ton_amount" INTEGER;',
+            # Агрегаты по часам (UTC): день - это 24 строки, независимо от кол-ва заказов.
+            """
+            CREATE TABLE IF NOT EXISTS "order_stats" (
+                "hour"         INTEGER NOT NULL,
+                "status"       TEXT    NOT NULL,
+                "orders"       INTEGER NOT NULL,
+                "stars_amount" INTEGER NOT NULL,
+                "ton_amount"   INTEGER NOT NULL,
+                PRIMARY KEY("hour", "status")
+            ) WITHOUT ROWID;
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS "order_stats_on_status"
+            AFTER UPDATE OF "status" ON "orders"
+            WHEN NEW."status" IS NOT OLD."status" AND {_stats_condition('NEW.')}
+            BEGIN
+                INSERT INTO "order_stats"
+                    ("hour", "status", "orders", "stars_amount", "ton_amount")
+                VALUES (
+                    CAST({NOW_SQL} / 3600 AS INTEGER) * 3600,
+                    NEW."status",
+                    1,
+                    COALESCE(NEW."stars_amount", 0),
+                    COALESCE(NEW."ton_amount", 0)
+                )
+                ON CONFLICT ("hour", "status") DO UPDATE SET
+                    "orders" = "orders" + 1,
+                    "stars_amount" = "stars_amount" + excluded."stars_amount",
+                    "ton_amount" = "ton_amount" + excluded."ton_amount";
+            END;
+            """,
+            # Заказы, завершенные до появления статистики. order_stars_amount регистрирует
+            # Sqlite3Storage (как и encode_blob). updated_at заказов, сохраненных до миграции 4,
+            # заполнит ее backfill уже после миграций, текущим временем: время их завершения
+            # неизвестно, поэтому они сразу учитываются в текущем часе.
+            f"""
+            INSERT INTO "order_stats" ("hour", "status", "orders", "stars_amount", "ton_amount")
+            SELECT
+                CAST(COALESCE("updated_at", {NOW_SQL}) / 3600 AS INTEGER) * 3600 AS "hour",
+                "status",
+                COUNT(*),
+                SUM(order_stars_amount("order_preview")),
+                0
+            FROM (
+                SELECT "updated_at", "status", "retries_left", "order_preview" FROM "orders"
+                UNION ALL
+                SELECT "updated_at", "status", "retries_left", "order_preview"
+                FROM "orders_archive"
+            )
+            WHERE {_stats_condition()}
+            GROUP BY 1, 2;
+            """,
+        ),
+        backfill=(
+            'UPDATE "orders" SET "stars_amount" = order_stars_amount("order_preview") '
+            'WHERE rowid IN (SELECT rowid FROM "orders" WHERE "stars_amount" IS NULL '
+            'LIMIT :batch_size)'
+        ),
+    ),
+    Migration(
+        version=8,
+        name='add_order_versions',
+        statements=(
+            # Версия заказа растет при каждом изменении (кроме продления аренды и backfill),
+            # запись измененного заказа проходит, только если версия в базе не изменилась.
+            'ALTER TABLE "orders" ADD COLUMN "version" INTEGER NOT NULL DEFAULT 0;',
+            'ALTER TABLE "orders_archive" ADD COLUMN "version" INTEGER NOT NULL DEFAULT 0;',
+        ),
+    ),
+)
+
+
+class Migrator:
+    def __init__(
+        self,
+        conn: Connection,
+        migrations: tuple[Migration, ...] = MIGRATIONS,
+        batch_size: int = 500,
+        lock: asyncio.Lock | None = None,
+    ) -> None:
+        self._conn = conn
+        # Блокировка записи хранилища: фоновое заполнение делит с ним соединение.
+        self._lock = lock if lock is not None else asyncio.Lock()
+        self._migrations = {i.version: i for i in sorted(migrations, key=lambda x: x.version)}
+        self._backfill_task: asyncio.Task | None = None
+        self.batch_size = batch_size
+
+    @property
+    def latest_version(self) -> int:
+        return max(self._migrations, default=0)
+
+    async def migrate(self) -> None:
+        await self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS "schema_migrations" (
+                "version"       INTEGER NOT NULL,
+                "name"          TEXT    NOT NULL,
+                "applied_at"    REAL    NOT NULL,
+                "backfilled_at" REAL,
+                PRIMARY KEY("version")
+            );
+        """)
+        await self._conn.commit()
+
+        current = await self.current_version()
+        if current > self.latest_version:
+            logger.warning(
+                'Версия базы данных (%d) новее, чем известна плагину (%d). Миграции пропущены.',
+                current,
+                self.latest_version,
+            )
+            return
+
+        await self._record_legacy(current)
+        for version, migration in self._migrations.items():
+            if version > current:
+                await self._apply(migration)
+
+    async def current_version(self) -> int:
+        cursor = await self._conn.execute('PRAGMA user_version;')
+        return (await cursor.fetchone())[0]
+
+    async def _record_legacy(self, current: int) -> None:
+        # Базы, созданные до появления schema_migrations, знают только user_version.
+        now = time.time()
+        await self._conn.executemany(
+            'INSERT OR IGNORE INTO schema_migrations (version, name, applied_at, backfilled_at) '
+            'VALUES (?, ?, ?, ?)',
+            [
+                (i.version, i.name, now, now)
+                for i in self._migrations.values()
+                if i.version <= current
+            ],
+        )
+        await self._conn.commit()
+
+    async def _apply(self, migration: Migration) -> None:
+        logger.info('Применяю миграцию %d (%s).', migration.version, migration.name)
+        await self._conn.execute('BEGIN')
+        try:
+            for statement in migration.statements:
+                await self._conn.execute(statement)
+            await self._conn.execute(
+                'INSERT OR REPLACE INTO schema_migrations '
+                '(version, name, applied_at, backfilled_at) VALUES (?, ?, ?, ?)',
+                (
+                    migration.version,
+                    migration.name,
+                    time.time(),
+                    None if migration.backfill else time.time(),
+                ),
+            )
+            await self._conn.execute(f'PRAGMA user_version = {migration.version};')
+        except Exception:
+            await self._conn.rollback()
+            raise
+        await self._conn.commit()
+
+    def start_backfills(self) -> None:
+        if self._backfill_task is None or self._backfill_task.done():
+            self._backfill_task = asyncio.create_task(self._run_backfills())
+            self._backfill_task.add_done_callback(self._backfills_done)
+
+    async def stop(self) -> None:
+        if self._backfill_task is not None and not self._backfill_task.done():
+            self._backfill_task.cancel()
+            try:
+                await self._backfill_task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run_backfills(self) -> None:
+        async with self._lock:
+            cursor = await self._conn.execute(
+                'SELECT version FROM schema_migrations WHERE backfilled_at IS NULL '
+                'ORDER BY version',
+            )
+            rows = await cursor.fetchall()
+        pending = [self._migrations[r[0]] for r in rows if r[0] in self._migrations]
+
+        for migration in pending:
+            if migration.backfill:
+                logger.info('Заполняю данные миграции %d (%s).', migration.version, migration.name)
+                while True:
+                    async with self._lock:
+                        cursor = await self._conn.execute(
+                            migration.backfill,
+                            {'batch_size': self.batch_size},
+                        )
+                        await self._conn.commit()
+                    if cursor.rowcount <= 0:
+                        break
+                    await asyncio.sleep(0)
+
+            async with self._lock:
+                await self._conn.execute(
+                    'UPDATE schema_migrations SET backfilled_at = ? WHERE version = ?',
+                    (time.time(), migration.version),
+                )
+                await self._conn.commit()
+
+    @staticmethod
+    def _backfills_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Ошибка заполнения данных миграций.', exc_info=task.exception())
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+
+__all__ = ['OrderFilter']
+
+
+from typing import Any
+from dataclasses import dataclass
+from collections.abc import Sequence
+
+from autostars.src.types.enums import StarsOrderStatus
+
+
+@dataclass(frozen=True)
+class OrderFilter:
+    """
+    Условия выборки заказов.
+
+    `since` / `until` ограничивают время последней смены статуса (`updated_at`),
+    `archived` - искать ли заказы также в `orders_archive`.
+    """
+
+    status: StarsOrderStatus | Sequence[StarsOrderStatus] | None = None
+    instance_id: str | None = None
+    same_instance: bool = True
+    since: float | None = None
+    until: float | None = None
+    archived: bool = False
+
+    def conditions(self) -> tuple[list[str], list[Any]]:
+        conditions: list[str] = []
+        params: list[Any] = []
+
+        if isinstance(self.status, StarsOrderStatus):
+            conditions.append('status = ?')
+            params.append(self.status.value)
+        elif self.status is not None:
+            conditions.append(f'status IN ({", ".join(["?"] * len(self.status))})')
+            params.extend(i.value for i in self.status)
+
+        if self.instance_id is not None:
+            conditions.append('hub_instance = ?' if self.same_instance else 'hub_instance != ?')
+            params.append(self.instance_id)
+
+        if self.since is not None:
+            conditions.append('updated_at >= ?')
+            params.append(self.since)
+        if self.until is not None:
+            conditions.append('updated_at < ?')
+            params.append(self.until)
+
+        return conditions, params
@@ -4,29 +4,150 @@ from __future__ import annotations
 __all__ = ['Storage', 'Sqlite3Storage']
 
 
-from typing import Any, Self
+import json
+import time
+import asyncio
+from enum import Enum
+from typing import Any, Self, Literal
+from functools import cache, partial
 from abc import ABC, abstractmethod
 from pathlib import Path
+from contextlib import asynccontextmanager
 from collections import defaultdict
+from collections.abc import Callable, Sequence, AsyncIterator
 
 import aiosqlite
 from aiosqlite import Cursor, Connection
-from autostars.src.types import StarsOrder
-from autostars.src.types.enums import StarsOrderStatus
+from autostars.src.types import (
+    OrderRow,
+    OrderEvent,
+    SalesStats,
+    StarsOrder,
+    CachedRecipient,
+)
+from autostars.src.logger import logger
+from autostars.src.exceptions import OrderVersionConflict
+from autostars.src.types.stars_order import BLOB_FIELDS, DB_MANAGED_FIELDS
+from autostars.src.types.enums import ErrorTypes, StarsOrderStatus
+from autostars.src.storage.codec import BlobCodec
+from autostars.src.storage.change_feed import ChangeFeed, OrderChange
+from autostars.src.storage.migrations import NOW_SQL, Migrator
+from autostars.src.storage.order_filter import OrderFilter
+from autostars.src.storage.write_buffer import PendingWrite, WriteBuffer
 
 
-USER_VERSION = 1
+READY_ORDERS_CONDITION = "(status = 'READY' OR (status = 'ERROR' AND retries_left > 0))"
+EXPIRED_LEASES_CONDITION = (
+    "status = 'PREPARING_TRANSFER' AND (lease_expires_at IS NULL OR lease_expires_at <= ?)"
+)
+OLD_ORDERS_CONDITION = (
+    "(status IN ('UNPROCESSED', 'WAITING_FOR_USERNAME', 'READY') "
+    "OR (status = 'ERROR' AND retries_left > 0))"
+)
+# Максимальная задержка повторного сохранения буфера записи после ошибки (сек.).
+MAX_FLUSH_RETRY_DELAY = 30
+
+
+@cache
+def _upsert_query(columns: tuple[str, ...]) -> str:
+    # JSON сообщения и превью заказа не меняются, поэтому при конфликте не перезаписываются.
+    updates = ', '.join(
+        f'{i} = excluded.{i}' for i in columns if i != 'order_id' and i not in BLOB_FIELDS
+    )
+    return (
+        f'INSERT INTO orders ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+        f'ON CONFLICT(order_id) DO UPDATE SET {updates}'
+    )
+
+
+# Колонки, которые можно менять через update_orders / update_old_orders.
+UPDATABLE_COLUMNS = frozenset(StarsOrder.model_fields) - {*BLOB_FIELDS, *DB_MANAGED_FIELDS}
+
+# Завершенные заказы, которые со временем переносятся в orders_archive.
+ARCHIVABLE_CONDITION = "status IN ('DONE', 'FORCE_DONE', 'REFUNDED', 'FORCE_REFUNDED')"
+ARCHIVE_COLUMNS = (
+    'order_id',
+    'hub_instance',
+    'status',
+    'error',
+    'retries_left',
+    'stars_amount',
+    'ton_amount',
+    'funpay_chat_id',
+    'telegram_username',
+    'recipient_id',
+    'fragment_request_id',
+    'ref',
+    'in_msg_hash',
+    'transaction_hash',
+    'message_obj',
+    'order_preview',
+    'updated_at',
+    'version',
+)
+
+
+# Индексы таблицы orders, которыми управляет Sqlite3Storage.setup: недостающие создаются,
+# измененные пересоздаются, лишние (с префиксом idx_orders_) удаляются.
+ORDERS_INDEXES = {
+    # get_orders / count_old_orders: status = / IN (...) и hub_instance != ?;
+    # страницы get_old_orders_page идут по order_id внутри статуса без сортировки.
+    'idx_orders_status_order': (
+        'CREATE INDEX "idx_orders_status_order" ON "orders" ("status", "order_id", "hub_instance")'
+    ),
+    # claim_ready_orders: частичный индекс только по заказам, которые можно переводить.
+    'idx_orders_ready': (
+        'CREATE INDEX "idx_orders_ready" ON "orders" ("hub_instance") '
+        f'WHERE {READY_ORDERS_CONDITION}'
+    ),
+    # archive_orders: завершенные заказы по времени последней смены статуса.
+    'idx_orders_archivable': (
+        'CREATE INDEX "idx_orders_archivable" ON "orders" ("updated_at") '
+        f'WHERE {ARCHIVABLE_CONDITION}'
+    ),
+    # recover_expired_leases / release_old_leases: заказы, захваченные воркерами.
+    'idx_orders_leases': (
+        'CREATE INDEX "idx_orders_leases" ON "orders" ("lease_expires_at") '
+        "WHERE status = 'PREPARING_TRANSFER'"
+    ),
+}
 
 
 class Storage(ABC):
+    @property
+    @abstractmethod
+    def changes(self) -> ChangeFeed:
+        """
+        Лента изменений статусов заказов, публикуемых после коммита.
+        """
+
     @abstractmethod
     async def add_or_update_order(self, order: StarsOrder) -> None: ...
 
     @abstractmethod
-    async def add_or_update_orders(self, *orders: StarsOrder) -> None: ...
+    async def add_or_update_orders(self, *orders: StarsOrder, wait: bool = False) -> None: ...
+
+    @abstractmethod
+    async def update_dirty_orders(self, *orders: StarsOrder, wait: bool = False) -> None: ...
 
-    # @abstractmethod
-    # async def update_orders(self, *order_ids: str, **kwargs: Any) -> None: ...
+    @abstractmethod
+    async def modify_order(
+        self,
+        order_id: str,
+        change: Callable[[StarsOrder], bool | None],
+        retries: int = 3,
+    ) -> StarsOrder | None: ...
+
+    @abstractmethod
+    async def update_orders(self, *order_ids: str, **fields: Any) -> list[str]: ...
+
+    @abstractmethod
+    async def update_old_orders(
+        self,
+        instance_id: str,
+        where_status: StarsOrderStatus | None = None,
+        **fields: Any,
+    ) -> list[str]: ...
 
     @abstractmethod
     async def get_order(self, order_id: str) -> StarsOrder | None: ...
@@ -37,6 +158,39 @@ class Storage(ABC):
         instance_id: str,
     ) -> dict[StarsOrderStatus, list[StarsOrder]]: ...
 
+    @abstractmethod
+    async def get_old_orders_page(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+        after: str | None = None,
+        limit: int = 50,
+        before: str | None = None,
+    ) -> list[StarsOrder]: ...
+
+    @abstractmethod
+    async def get_old_orders_cursor(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+        offset: int = 0,
+    ) -> str | None: ...
+
+    @abstractmethod
+    async def count_old_orders(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+    ) -> int: ...
+
+    @abstractmethod
+    async def count_orders_by_status(
+        self,
+        instance_id: str | None = None,
+        same_instance: bool = True,
+        old_only: bool = False,
+    ) -> dict[StarsOrderStatus, int]: ...
+
     @abstractmethod
     async def stop(self) -> None: ...
 
@@ -47,7 +201,20 @@ class Storage(ABC):
         status: StarsOrderStatus | list[StarsOrderStatus] | None = None,
         instance_id: str | None = None,
         same_instance: bool = True,
-    ) -> dict[str, StarsOrder]: ...
+        columns: Sequence[str] | None = None,
+    ) -> dict[str, StarsOrder] | dict[str, OrderRow]:
+        """
+        Если переданы `columns`, читаются только эти колонки (и `order_id`), а вместо
+        `StarsOrder` возвращаются `OrderRow` - без валидации pydantic и разбора JSON.
+        """
+
+    @abstractmethod
+    def iter_orders(
+        self,
+        order_filter: OrderFilter | None = None,
+        batch_size: int = 500,
+        columns: Sequence[str] | None = None,
+    ) -> AsyncIterator[StarsOrder | OrderRow]: ...
 
     @abstractmethod
     async def get_ready_orders(
@@ -57,79 +224,612 @@ class Storage(ABC):
     ) -> dict[str, StarsOrder]: ...
 
     @abstractmethod
-    async def delete_orders(self, *order_ids: str) -> None: ...
+    async def claim_ready_orders(
+        self,
+        instance_id: str,
+        owner: str,
+        lease: float,
+        amount: int = 65,
+    ) -> dict[str, StarsOrder]: ...
+
+    @abstractmethod
+    async def renew_leases(self, owner: str, lease: float, *order_ids: str) -> list[str]: ...
+
+    @abstractmethod
+    async def recover_expired_leases(self, instance_id: str | None = None) -> list[str]: ...
+
+    @abstractmethod
+    async def release_old_leases(self, instance_id: str) -> list[str]: ...
+
+    @abstractmethod
+    async def delete_orders(self, *order_ids: str) -> list[str]: ...
+
+    @abstractmethod
+    async def delete_old_orders(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+    ) -> list[str]: ...
+
+    @abstractmethod
+    async def get_order_events(self, order_id: str) -> list[OrderEvent]: ...
+
+    @abstractmethod
+    async def get_events(
+        self,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int | None = None,
+    ) -> list[OrderEvent]: ...
+
+    @abstractmethod
+    async def get_stage_latencies(
+        self,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> dict[tuple[StarsOrderStatus | None, StarsOrderStatus], list[float]]: ...
+
+    @abstractmethod
+    async def get_sales_stats(
+        self,
+        since: float,
+        until: float | None = None,
+        period: Literal['hour', 'day'] = 'day',
+    ) -> list[SalesStats]: ...
+
+    @abstractmethod
+    async def get_recipient(self, username: str) -> CachedRecipient | None: ...
+
+    @abstractmethod
+    async def save_recipient(self, recipient: CachedRecipient) -> None: ...
+
+
+SynchronousMode = Literal['OFF', 'NORMAL', 'FULL', 'EXTRA']
 
 
 class Sqlite3Storage(Storage):
-    def __init__(self, path: str | Path):
+    """
+    Хранилище в SQLite в режиме WAL.
+
+    Все записи идут через одно соединение, чтения - через пул соединений только для чтения,
+    поэтому запросы меню не ждут коммитов сервиса переводов.
+
+    Чтения не сбрасывают буфер записи (см. `write_delay`) и видят только сохраненные
+    изменения: данные меню и выгрузок могут отставать от сервиса не больше чем на
+    `write_delay`. Кому нужно прочитать свои записи, сначала вызывает `flush()`;
+    `modify_order` делает это сам для изменяемого заказа.
+
+    :param readers: количество соединений для чтения.
+    :param synchronous: `PRAGMA synchronous` соединения для записи.
+        В режиме WAL `NORMAL` не теряет целостность базы, но последние коммиты могут
+        пропасть при отключении питания.
+    :param wal_autocheckpoint: размер WAL (в страницах), после которого SQLite сам делает
+        чекпоинт. `0` отключает автоматические чекпоинты.
+    :param checkpoint_interval: интервал (в секундах) фоновых чекпоинтов `PASSIVE`.
+        `None` отключает фоновые чекпоинты.
+    :param archive_after: через сколько секунд после последней смены статуса завершенные
+        заказы переносятся в `orders_archive` со сжатым JSON. `None` отключает архивацию.
+    :param archive_interval: интервал (в секундах) фоновой архивации.
+    :param archive_batch_size: количество заказов, переносимых одной транзакцией.
+    :param codec: кодек JSON сообщений и превью заказов.
+        По умолчанию - zlib со словарем, собранным из сохраненных заказов.
+    :param write_delay: окно (в секундах), в течение которого изменения заказов копятся
+        в памяти и затем сохраняются одной транзакцией. `None` - сохранять сразу.
+        Переход в `TRANSFERRING` с `in_msg_hash` и в `REFUNDED` всегда сохраняется сразу
+        с `synchronous = FULL`.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        readers: int = 2,
+        synchronous: SynchronousMode = 'NORMAL',
+        wal_autocheckpoint: int = 1000,
+        checkpoint_interval: float | None = 300,
+        archive_after: float | None = 7 * 24 * 60 * 60,
+        archive_interval: float = 60 * 60,
+        archive_batch_size: int = 200,
+        codec: BlobCodec | None = None,
+        write_delay: float | None = None,
+    ):
         self._path = Path(path)
         self._conn: Connection | None = None
+        self._migrator: Migrator | None = None
+        self._readers: asyncio.Queue[Connection] = asyncio.Queue()
+        self._checkpoint_task: asyncio.Task | None = None
+        self._archive_task: asyncio.Task | None = None
+        self._changes = ChangeFeed()
+        self._last_event_id = 0
+        self._writes = WriteBuffer()
+        # Все запросы с коммитом на соединении записи выполняются под этой блокировкой.
+        self._write_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+        self.readers = readers
+        self.synchronous = synchronous
+        self.wal_autocheckpoint = wal_autocheckpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.archive_after = archive_after
+        self.archive_interval = archive_interval
+        self.archive_batch_size = archive_batch_size
+        self.codec = codec if codec is not None else BlobCodec()
+        self.write_delay = write_delay
 
     async def setup(self) -> None:
         self.path.parent.mkdir(parents=True, exist_ok=True)
         self._conn = await aiosqlite.connect(self.path)
         self._conn.row_factory = aiosqlite.Row
+        await self._conn.create_function('encode_blob', 1, self.codec.encode_sql)
+        await self._conn.create_function(
+            'order_stars_amount',
+            1,
+            self._stars_amount_sql,
+            deterministic=True,
+        )
+        await self._conn.execute('PRAGMA journal_mode = WAL;')
+        await self._conn.execute(f'PRAGMA synchronous = {self.synchronous};')
+        await self._conn.execute(f'PRAGMA wal_autocheckpoint = {int(self.wal_autocheckpoint)};')
 
-        cur = await self._conn.execute('PRAGMA user_version;')
-        r = await cur.fetchone()
-        if r['user_version'] != USER_VERSION:
-            await cur.execute('DROP TABLE IF EXISTS orders;')
-            await cur.execute(f'PRAGMA user_version = {USER_VERSION};')
-            await self._conn.commit()
-
-        await self._conn.execute("""
-            CREATE TABLE IF NOT EXISTS "orders" (
-	            "order_id"	          TEXT    NOT NULL UNIQUE,
-	            "hub_instance"        TEXT    NOT NULL,
-	            
-	            "status"	          TEXT    NOT NULL,
-                "error"	              TEXT,
-                "retries_left"        INTEGER NOT NULL,
-                
-                "funpay_chat_id"      INTEGER NOT NULL,
-                "telegram_username"	  TEXT,
-                
-                "recipient_id"        TEXT,
-                "fragment_request_id" TEXT,
-                "ref"                 TEXT,
-                "in_msg_hash"         TEXT,
-                "transaction_hash"    TEXT,
-
-                "message_obj"	      TEXT    NOT NULL,
-                "order_preview"	      TEXT    NOT NULL,
-                PRIMARY KEY("order_id")
-);""")
+        self._migrator = Migrator(self._conn, lock=self._write_lock)
+        await self._migrator.migrate()
 
-    async def stop(self):
-        await self._conn.close()
+        cursor = await self.raw_query('SELECT MAX(id) FROM order_events', commit=False)
+        self._last_event_id = (await cursor.fetchone())[0] or 0
 
-    async def add_or_update_order(self, order: StarsOrder, commit: bool = True) -> None:
-        data = order.model_dump(mode='json')
-        keys = ', '.join(data.keys())
-        placeholders = ', '.join(['?'] * len(data))
-        values = tuple(data.values())
+        await self.raw_query('DELETE FROM recipients WHERE expires_at <= ?', time.time())
+        await self._sync_indexes()
+        await self._load_dictionaries()
+        self._migrator.start_backfills()
+
+        for _ in range(max(self.readers, 1)):
+            reader = await aiosqlite.connect(f'{self.path.resolve().as_uri()}?mode=ro', uri=True)
+            reader.row_factory = aiosqlite.Row
+            await self._readers.put(reader)
+
+        if self.checkpoint_interval:
+            self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+        if self.archive_after is not None:
+            self._archive_task = asyncio.create_task(self._archive_loop())
+
+    @property
+    def changes(self) -> ChangeFeed:
+        return self._changes
+
+    def _stars_amount_sql(self, order_preview: str | bytes) -> int:
+        # Функция order_stars_amount для SQL. 0 - кол-во звезд не удалось определить.
+        try:
+            title = json.loads(self.codec.decode(order_preview))['title']
+            return StarsOrder.parse_stars_amount(title) or 0
+        except Exception:
+            return 0
+
+    async def _commit(self) -> None:
+        await self._conn.commit()
+        await self._publish_changes()
+
+    async def _publish_changes(self) -> None:
+        # Новые строки order_events (их пишут триггеры) - это и есть изменения этого коммита.
+        # Вызывается из _commit под блокировкой записи.
+        cursor = await self._conn.execute(
+            'SELECT id, order_id, from_status, to_status FROM order_events '
+            'WHERE id > ? ORDER BY id',
+            (self._last_event_id,),
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            return
+
+        self._last_event_id = rows[-1]['id']
+        self._changes.publish(
+            OrderChange(
+                event_id=row['id'],
+                order_id=row['order_id'],
+                old_status=StarsOrderStatus(row['from_status']) if row['from_status'] else None,
+                new_status=StarsOrderStatus(row['to_status']),
+            )
+            for row in rows
+        )
+
+    async def _load_dictionaries(self, samples: int = 200) -> None:
+        cursor = await self.raw_query(
+            'SELECT id, data FROM blob_dictionaries ORDER BY id',
+            commit=False,
+        )
+        for row in await cursor.fetchall():
+            self.codec.add_dictionary(row['id'], row['data'])
+
+        if self.codec.dictionary_id is not None:
+            return
+
+        # Словарь собирается один раз из заказов, сохраненных до его появления.
+        cursor = await self.raw_query(
+            'SELECT message_obj, order_preview FROM orders ORDER BY rowid DESC LIMIT ?',
+            samples,
+            commit=False,
+        )
+        rows = await cursor.fetchall()
+        if len(rows) < samples // 4:
+            return
 
+        data = self.codec.train_dictionary(
+            self.codec.decode(row[i]) for row in reversed(rows) for i in BLOB_FIELDS
+        )
         await self.raw_query(
-            f'INSERT OR REPLACE INTO orders ({keys}) VALUES ({placeholders})',
-            *values,
+            'INSERT INTO blob_dictionaries (id, data, created_at) VALUES (?, ?, ?)',
+            1,
+            data,
+            time.time(),
+        )
+        self.codec.add_dictionary(1, data)
+
+    def _order_from_row(self, row: aiosqlite.Row) -> StarsOrder:
+        data = dict(row)
+        data.pop('archived_at', None)
+        for i in BLOB_FIELDS:
+            data[i] = self.codec.decode(data[i])
+        return StarsOrder.from_row(data)
+
+    def _order_row_from_row(self, row_class: type[OrderRow], row: aiosqlite.Row) -> OrderRow:
+        if not any(i in row_class.columns for i in BLOB_FIELDS):
+            return row_class(row)
+
+        data = dict(row)
+        for i in BLOB_FIELDS:
+            if i in data:
+                data[i] = self.codec.decode(data[i])
+        return row_class(data)
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[Connection]:
+        reader = await self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def _read(self, query: str, *args: Any) -> list[aiosqlite.Row]:
+        async with self._reader() as reader:
+            cursor = await reader.execute(query, args)
+            try:
+                return await cursor.fetchall()
+            finally:
+                await cursor.close()
+
+    async def archive_orders(self, older_than: float, batch_size: int = 200) -> int:
+        """
+        Переносит в `orders_archive` не более `batch_size` завершенных заказов, статус
+        которых не менялся с `older_than` (unix timestamp). Возвращает количество заказов.
+        """
+        async with self._write_lock:
+            await self._flush()
+            cursor = await self.raw_query(
+                f'SELECT order_id FROM orders WHERE {ARCHIVABLE_CONDITION} AND updated_at <= ? '
+                'LIMIT ?',
+                older_than,
+                batch_size,
+                commit=False,
+            )
+            order_ids = [row['order_id'] for row in await cursor.fetchall()]
+            if not order_ids:
+                return 0
+
+            placeholders = ', '.join(['?'] * len(order_ids))
+            values = ', '.join(
+                f'encode_blob({i})' if i in BLOB_FIELDS else i for i in ARCHIVE_COLUMNS
+            )
+            try:
+                await self.raw_query(
+                    f'INSERT OR REPLACE INTO orders_archive ({", ".join(ARCHIVE_COLUMNS)}, '
+                    f'archived_at) SELECT {values}, {NOW_SQL} FROM orders '
+                    f'WHERE order_id IN ({placeholders})',
+                    *order_ids,
+                    commit=False,
+                )
+                await self.raw_query(
+                    f'DELETE FROM orders WHERE order_id IN ({placeholders})',
+                    *order_ids,
+                    commit=False,
+                )
+            except Exception:
+                await self._conn.rollback()
+                raise
+            await self._commit()
+        return len(order_ids)
+
+    async def _archive_loop(self) -> None:
+        while True:
+            archived = 0
+            try:
+                older_than = time.time() - self.archive_after
+                while amount := await self.archive_orders(older_than, self.archive_batch_size):
+                    archived += amount
+                    if amount < self.archive_batch_size:
+                        break
+                    await asyncio.sleep(0)
+            except Exception:
+                logger.warning('Ошибка архивации заказов.', exc_info=True)
+
+            if archived:
+                logger.info('Перенесено в архив заказов: %d.', archived)
+            await asyncio.sleep(self.archive_interval)
+
+    async def checkpoint(self, mode: str = 'PASSIVE') -> None:
+        async with self._write_lock:
+            await self._conn.execute(f'PRAGMA wal_checkpoint({mode});')
+
+    async def _checkpoint_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception:
+                logger.warning('Ошибка чекпоинта WAL.', exc_info=True)
+
+    async def _sync_indexes(self) -> None:
+        cursor = await self.raw_query(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = 'orders' AND name GLOB 'idx_orders_*'",
             commit=False,
         )
+        existing = {row['name']: row['sql'] for row in await cursor.fetchall()}
+
+        async with self._write_lock:
+            for name, sql in list(existing.items()):
+                if ORDERS_INDEXES.get(name) != sql:
+                    await self._conn.execute(f'DROP INDEX "{name}"')
+                    existing.pop(name)
+
+            for name, sql in ORDERS_INDEXES.items():
+                if name not in existing:
+                    await self._conn.execute(sql)
+            await self._commit()
+
+    async def stop(self):
+        for task in (self._checkpoint_task, self._archive_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        async with self._write_lock:
+            await self._flush()
+        if self._migrator is not None:
+            await self._migrator.stop()
+
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+        await self.checkpoint('TRUNCATE')
+        await self._conn.close()
+
+    async def add_or_update_order(self, order: StarsOrder, commit: bool = True) -> None:
+        await self._save((order,), commit=commit)
+
+    async def add_or_update_orders(self, *orders: StarsOrder, wait: bool = False) -> None:
+        """
+        :param wait: сохранить сразу, не дожидаясь отложенного сброса буфера. Без этого
+            при `write_delay` конфликт версий только логируется при сбросе, а не поднимается.
+        """
+        await self._save(orders, wait=wait)
+
+    async def update_dirty_orders(self, *orders: StarsOrder, wait: bool = False) -> None:
+        """
+        Записывает только измененные поля уже сохраненных заказов.
+        `wait` - как в `add_or_update_orders`.
+        """
+        await self._save(orders, partial=True, wait=wait)
+
+    async def modify_order(
+        self,
+        order_id: str,
+        change: Callable[[StarsOrder], bool | None],
+        retries: int = 3,
+    ) -> StarsOrder | None:
+        """
+        Загружает заказ, применяет к нему `change` и сразу сохраняет с проверкой версии.
+        Если заказ успели изменить, он загружается заново и `change` применяется повторно
+        (не больше `retries` раз), поэтому `change` не должна иметь побочных эффектов.
+
+        Возвращает сохраненный заказ или `None`, если заказа нет или `change` вернула `False`.
+
+        :raises OrderVersionConflict: если попытки закончились.
+        """
+        for attempt in range(retries + 1):
+            if order_id in self._writes:
+                # Чтения не видят буфер записи: без сброса загрузится устаревшая копия.
+                try:
+                    await self.flush()
+                except OrderVersionConflict:
+                    pass
+            order = await self.get_order(order_id)
+            if order is None or change(order) is False:
+                return None
+
+            try:
+                await self._save((order,), partial=True, commit=False)
+                await self.flush()
+            except OrderVersionConflict as e:
+                if order_id not in e.order_ids:
+                    return order
+                if attempt == retries:
+                    raise
+                logger.debug('Заказ %s изменен другой задачей, повторяю (%d).', order_id, attempt)
+            else:
+                return order
+        return None
+
+    async def _save(
+        self,
+        orders: Sequence[StarsOrder],
+        partial: bool = False,
+        commit: bool = True,
+        wait: bool = False,
+    ) -> None:
+        """
+        :raises OrderVersionConflict: если часть заказов изменили с момента их загрузки.
+            Остальные заказы сохраняются.
+        """
+        if not orders:
+            return
 
+        conflicts = [i.order_id for i in orders if not self._buffer(i, partial=partial)]
         if commit:
-            await self._conn.commit()
+            try:
+                await (self.flush() if wait else self._commit_writes())
+            except OrderVersionConflict as e:
+                # Конфликты чужих записей из того же буфера уже залогированы в _flush.
+                own = {i.order_id for i in orders}
+                conflicts.extend(i for i in e.order_ids if i in own)
 
-    async def add_or_update_orders(self, *orders: StarsOrder) -> None:
-        for order in orders:
-            await self.add_or_update_order(order, commit=False)
-        await self._conn.commit()
+        if conflicts:
+            raise OrderVersionConflict(conflicts)
+
+    def _buffer(self, order: StarsOrder, partial: bool = False) -> bool:
+        # Заказы из базы обновляются частично, новые (или с замененным JSON) - целиком.
+        if partial or (order.persisted and not order.dirty_fields & set(BLOB_FIELDS)):
+            row, insert = order.dirty_row(), False
+        else:
+            row, insert = order.to_row(), True
+            for i in BLOB_FIELDS:
+                row[i] = self.codec.encode(row[i])
+
+        if row:
+            # После падения заказ с отправленным переводом не должен вернуться в READY.
+            # Возврат средств тоже сохраняется сразу: версия заказа должна быть проверена
+            # до того, как деньги уйдут покупателю.
+            durable = (
+                order.status is StarsOrderStatus.TRANSFERRING
+                and ('status' in row or 'in_msg_hash' in row)
+            ) or (order.status is StarsOrderStatus.REFUNDED and 'status' in row)
+            row['version'] = order.version + 1
+            # Версия модели и ее измененные поля обновляются только после коммита (_flush).
+            return self._writes.add(
+                order.order_id,
+                row,
+                insert,
+                durable=durable,
+                expected_version=order.version,
+                order=order,
+            )
+        return True
+
+    async def _commit_writes(self) -> None:
+        if self.write_delay is None or self._writes.durable:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush(self.write_delay))
+
+    async def _delayed_flush(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except OrderVersionConflict:
+            pass
+        except Exception:
+            logger.error('Ошибка сохранения заказов.', exc_info=True)
+            # Записи вернулись в буфер: повторяем сохранение, увеличивая задержку.
+            if self._writes and self._flush_task is None:
+                self._flush_task = asyncio.create_task(
+                    self._delayed_flush(min(max(delay, 0.1) * 2, MAX_FLUSH_RETRY_DELAY)),
+                )
+
+    async def flush(self) -> None:
+        """
+        Сохраняет буфер записи одной транзакцией.
+
+        :raises OrderVersionConflict: если часть заказов в базе изменили после их загрузки.
+            Записи этих заказов отбрасываются, остальные сохраняются.
+        """
+        async with self._write_lock:
+            conflicts = await self._flush()
+        if conflicts:
+            raise OrderVersionConflict(conflicts)
+
+    async def _flush(self) -> list[str]:
+        writes = self._writes.take()
+        if not writes:
+            return []
+
+        durable = any(i.durable for i in writes)
+        try:
+            if durable:
+                await self._conn.execute('PRAGMA synchronous = FULL;')
+            # Версии проверяются и записываются под одной блокировкой записи.
+            if not self._conn.in_transaction:
+                await self._conn.execute('BEGIN IMMEDIATE')
+            conflicts = await self._version_conflicts(writes)
+            written = [i for i in writes if i.order_id not in conflicts]
+            await self._write_rows(written)
+            await self._commit()
+        except Exception:
+            await self._conn.rollback()
+            self._writes.restore(writes)
+            raise
+        finally:
+            if durable:
+                await self._conn.execute(f'PRAGMA synchronous = {self.synchronous};')
+
+        for write in written:
+            for order in write.orders:
+                order.version = write.row['version']
+                order.mark_clean()
+            self._writes.rebase(write)
+
+        if conflicts:
+            logger.warning(
+                'Заказы %s изменены другой задачей после загрузки, их изменения не сохранены.',
+                conflicts,
+            )
+        return conflicts
+
+    async def _version_conflicts(self, writes: list[PendingWrite]) -> list[str]:
+        versions: dict[str, int] = {}
+        order_ids = [i.order_id for i in writes]
+        for start in range(0, len(order_ids), 500):
+            chunk = order_ids[start:start + 500]
+            cursor = await self._conn.execute(
+                f'SELECT order_id, version FROM orders '
+                f'WHERE order_id IN ({", ".join(["?"] * len(chunk))})',
+                chunk,
+            )
+            versions.update((row['order_id'], row['version']) for row in await cursor.fetchall())
+
+        # Заказа нет в orders (новый, удален или в архиве) - конфликта нет.
+        return [
+            i.order_id
+            for i in writes
+            if i.order_id in versions and versions[i.order_id] != i.expected_version
+        ]
+
+    async def _write_rows(self, writes: list[PendingWrite]) -> None:
+        inserts: dict[tuple[str, ...], list[tuple[Any, ...]]] = defaultdict(list)
+        updates: dict[tuple[str, ...], list[tuple[Any, ...]]] = defaultdict(list)
+        for write in writes:
+            if write.insert:
+                inserts[tuple(write.row)].append(tuple(write.row.values()))
+            else:
+                updates[tuple(write.row)].append((*write.row.values(), write.order_id))
+
+        for columns, values in inserts.items():
+            await self._conn.executemany(_upsert_query(columns), values)
+
+        for columns, values in updates.items():
+            await self._conn.executemany(
+                f'UPDATE orders SET {", ".join(f"{i} = ?" for i in columns)} WHERE order_id = ?',
+                values,
+            )
 
     async def get_order(self, order_id: str) -> StarsOrder | None:
-        cursor = await self.raw_query('SELECT * FROM orders WHERE order_id = ?', order_id)
-        data = await cursor.fetchone()
-        if not data:
-            return None
+        if rows := await self._read('SELECT * FROM orders WHERE order_id = ?', order_id):
+            return self._order_from_row(rows[0])
 
-        return StarsOrder.model_validate(dict(data))
+        if rows := await self._read('SELECT * FROM orders_archive WHERE order_id = ?', order_id):
+            return self._order_from_row(rows[0])
+        return None
 
     async def get_orders(
         self,
@@ -137,85 +837,511 @@ class Sqlite3Storage(Storage):
         status: StarsOrderStatus | list[StarsOrderStatus] | None = None,
         instance_id: str | None = None,
         same_instance: bool = True,
+        columns: Sequence[str] | None = None,
+    ) -> dict[str, StarsOrder] | dict[str, OrderRow]:
+        conditions, params = OrderFilter(
+            status=status,
+            instance_id=instance_id,
+            same_instance=same_instance,
+        ).conditions()
+        make_order = self._order_factory(columns)
+
+        if not order_ids:
+            where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+            select = self._select_list('orders', columns)
+            return {
+                row['order_id']: make_order(row)
+                for row in await self._read(f'SELECT {select} FROM orders{where}', *params)
+            }
+
+        # Заказы, которых нет в orders, ищутся в архиве.
+        result: dict[str, Any] = {}
+        for table in ('orders', 'orders_archive'):
+            if not (ids := [i for i in order_ids if i not in result]):
+                break
+
+            select = self._select_list(table, columns)
+            where = ' AND '.join([*conditions, f'order_id IN ({", ".join(["?"] * len(ids))})'])
+            rows = await self._read(f'SELECT {select} FROM {table} WHERE {where}', *params, *ids)
+            result.update((row['order_id'], make_order(row)) for row in rows)
+        return result
+
+    async def iter_orders(
+        self,
+        order_filter: OrderFilter | None = None,
+        batch_size: int = 500,
+        columns: Sequence[str] | None = None,
+    ) -> AsyncIterator[StarsOrder | OrderRow]:
+        """
+        Перебирает заказы по `order_id` пачками по `batch_size`.
+        В памяти одновременно находится не больше одной пачки, а соединение для чтения
+        не удерживается между пачками.
+        """
+        order_filter = order_filter if order_filter is not None else OrderFilter()
+        conditions, params = order_filter.conditions()
+        make_order = self._order_factory(columns)
+        tables = ('orders', 'orders_archive') if order_filter.archived else ('orders',)
+
+        for table in tables:
+            select = self._select_list(table, columns)
+            after: str | None = None
+            while True:
+                where = [*conditions, 'order_id > ?'] if after is not None else conditions
+                query = f'SELECT {select} FROM {table}'
+                if where:
+                    query += f' WHERE {" AND ".join(where)}'
+                rows = await self._read(
+                    f'{query} ORDER BY order_id LIMIT ?',
+                    *params,
+                    *(() if after is None else (after,)),
+                    batch_size,
+                )
+                for row in rows:
+                    yield make_order(row)
+
+                if len(rows) < batch_size:
+                    break
+                after = rows[-1]['order_id']
+
+    def _order_factory(
+        self,
+        columns: Sequence[str] | None,
+    ) -> Callable[[aiosqlite.Row], StarsOrder | OrderRow]:
+        if columns is None:
+            return self._order_from_row
+        row_class = OrderRow.for_columns(('order_id', *(i for i in columns if i != 'order_id')))
+        return partial(self._order_row_from_row, row_class)
+
+    @staticmethod
+    def _select_list(table: str, columns: Sequence[str] | None) -> str:
+        if columns is None:
+            return '*'
+
+        # В архиве нет колонок аренды: для архивных заказов они всегда NULL.
+        columns = ('order_id', *(i for i in columns if i != 'order_id'))
+        return ', '.join(
+            f'NULL AS {i}' if table == 'orders_archive' and i not in ARCHIVE_COLUMNS else i
+            for i in columns
+        )
+
+    async def get_ready_orders(self, instance_id: str, amount=65) -> dict[str, StarsOrder]:
+        sql = f'SELECT * FROM orders WHERE {READY_ORDERS_CONDITION} AND hub_instance = ? LIMIT ?'
+
+        return {
+            row['order_id']: self._order_from_row(row)
+            for row in await self._read(sql, instance_id, amount)
+        }
+
+    async def claim_ready_orders(
+        self,
+        instance_id: str,
+        owner: str,
+        lease: float,
+        amount: int = 65,
     ) -> dict[str, StarsOrder]:
-        sql = 'SELECT * FROM orders'
-        conditions = []
-        params = []
+        """
+        Атомарно захватывает готовые заказы: переводит их в `PREPARING_TRANSFER`,
+        уменьшает количество попыток и выдает аренду `owner` на `lease` секунд.
 
-        if order_ids:
-            placeholders = ', '.join(['?'] * len(order_ids))
-            conditions.append(f'order_id IN ({placeholders})')
-            params.extend(order_ids)
+        Заказ, который другой воркер держит в аренде, захватить нельзя, поэтому несколько
+        процессов могут разбирать одну базу одновременно.
+        """
+        now = time.time()
+        async with self._write_lock:
+            await self._flush()
+            cursor = await self.raw_query(
+                "UPDATE orders SET status = 'PREPARING_TRANSFER', version = version + 1, "
+                'retries_left = retries_left - 1, lease_owner = ?, lease_expires_at = ? '
+                'WHERE order_id IN ('
+                f'SELECT order_id FROM orders WHERE {READY_ORDERS_CONDITION} '
+                'AND hub_instance = ? '
+                'AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires_at <= ?) '
+                'LIMIT ?'
+                ') RETURNING *',
+                owner,
+                now + lease,
+                instance_id,
+                owner,
+                now,
+                amount,
+                commit=False,
+            )
+            rows = await cursor.fetchall()
+            await self._commit()
+
+        return {row['order_id']: self._order_from_row(row) for row in rows}
+
+    async def renew_leases(self, owner: str, lease: float, *order_ids: str) -> list[str]:
+        """
+        Продлевает аренду заказов. Возвращает ID заказов, аренда которых продлена.
+        """
+        if not order_ids:
+            return []
+
+        placeholders = ', '.join(['?'] * len(order_ids))
+        return await self._modify_orders(
+            'UPDATE orders SET lease_expires_at = ? '
+            f'WHERE lease_owner = ? AND order_id IN ({placeholders}) RETURNING order_id',
+            time.time() + lease,
+            owner,
+            *order_ids,
+        )
 
+    async def recover_expired_leases(self, instance_id: str | None = None) -> list[str]:
+        """
+        Возвращает в `READY` заказы в `PREPARING_TRANSFER`, аренда которых истекла
+        (воркер упал или завис). Статус `TRANSFERRING` сохраняется до отправки сообщения
+        в блокчейн, так что по этим заказам перевод точно не отправлялся.
+
+        Если указан `instance_id`, заказы переходят этому инстансу, и их захватит его воркер,
+        даже если упал единственный воркер инстанса заказа.
+        """
+        reassign = 'hub_instance = ?, ' if instance_id is not None else ''
+        recovered = await self._modify_orders(
+            f"UPDATE orders SET status = 'READY', {reassign}version = version + 1, "
+            'lease_owner = NULL, lease_expires_at = NULL '
+            f'WHERE {EXPIRED_LEASES_CONDITION} RETURNING order_id',
+            *((instance_id,) if instance_id is not None else ()),
+            time.time(),
+        )
+
+        if recovered:
+            logger.info('Истекла аренда заказов %s, заказы возвращены в очередь.', recovered)
+        return recovered
+
+    async def release_old_leases(self, instance_id: str) -> list[str]:
+        """
+        Возвращает в `READY` заказы в `PREPARING_TRANSFER` других инстансов (прошлых запусков),
+        аренда которых истекла. Заказы остаются за своим инстансом и попадают в старые заказы.
+        Заказы с живой арендой обрабатывает другой воркер, их не трогаем.
+        """
+        released = await self._modify_orders(
+            "UPDATE orders SET status = 'READY', version = version + 1, "
+            'lease_owner = NULL, lease_expires_at = NULL '
+            f'WHERE {EXPIRED_LEASES_CONDITION} AND hub_instance != ? RETURNING order_id',
+            time.time(),
+            instance_id,
+        )
+
+        if released:
+            logger.info('Заказы %s с прошлых запусков возвращены в статус READY.', released)
+        return released
+
+    async def get_old_orders(self, instance_id: str) -> dict[StarsOrderStatus, list[StarsOrder]]:
+        rows = await self._read(
+            f'SELECT * FROM orders WHERE {OLD_ORDERS_CONDITION} AND hub_instance != ?',
+            instance_id,
+        )
+
+        orders_dict = defaultdict(list)
+        for row in rows:
+            order = self._order_from_row(row)
+            orders_dict[order.status].append(order)
+
+        return orders_dict
+
+    @staticmethod
+    def _old_orders_filter(
+        instance_id: str,
+        status: StarsOrderStatus | None,
+    ) -> tuple[str, list[Any]]:
+        sql, params = f'{OLD_ORDERS_CONDITION} AND hub_instance != ?', [instance_id]
         if status is not None:
-            if isinstance(status, list):
-                placeholders = ', '.join(['?'] * len(status))
-                conditions.append(f'status IN ({placeholders})')
-                params.extend([s.value for s in status])
-            else:
-                conditions.append('status = ?')
-                params.append(status.value)
+            sql += ' AND status = ?'
+            params.append(status.value)
+        return sql, params
 
+    async def get_old_orders_page(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+        after: str | None = None,
+        limit: int = 50,
+        before: str | None = None,
+    ) -> list[StarsOrder]:
+        """
+        Страница старых заказов, отсортированных по `order_id`.
+        `after` - `order_id` последнего заказа предыдущей страницы, `before` - первого
+        заказа следующей (тогда возвращаются `limit` заказов прямо перед ним).
+        """
+        sql, params = self._old_orders_filter(instance_id, status)
+        if after is not None:
+            sql += ' AND order_id > ?'
+            params.append(after)
+        if before is not None:
+            sql += ' AND order_id < ?'
+            params.append(before)
+
+        order = 'DESC' if before is not None and after is None else 'ASC'
+        rows = await self._read(
+            f'SELECT * FROM orders WHERE {sql} ORDER BY order_id {order} LIMIT ?',
+            *params,
+            limit,
+        )
+        orders = [self._order_from_row(row) for row in rows]
+        return orders[::-1] if order == 'DESC' else orders
+
+    async def get_old_orders_cursor(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+        offset: int = 0,
+    ) -> str | None:
+        """
+        Курсор (`after`) для страницы, которая начинается с `offset`-го заказа.
+        Пропускает `offset` заказов (OFFSET), поэтому нужен только для перехода сразу
+        на дальнюю страницу: соседние читаются от крайних заказов текущей.
+        """
+        if offset <= 0:
+            return None
+
+        sql, params = self._old_orders_filter(instance_id, status)
+        rows = await self._read(
+            f'SELECT order_id FROM orders WHERE {sql} ORDER BY order_id LIMIT 1 OFFSET ?',
+            *params,
+            offset - 1,
+        )
+        return rows[0]['order_id'] if rows else None
+
+    async def count_old_orders(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+    ) -> int:
+        sql, params = self._old_orders_filter(instance_id, status)
+        rows = await self._read(f'SELECT COUNT(*) FROM orders WHERE {sql}', *params)
+        return rows[0][0]
+
+    async def count_orders_by_status(
+        self,
+        instance_id: str | None = None,
+        same_instance: bool = True,
+        old_only: bool = False,
+    ) -> dict[StarsOrderStatus, int]:
+        """
+        Количество заказов по статусам. Статусы без заказов в результат не попадают.
+
+        :param old_only: считать только незавершенные заказы (как в `get_old_orders`).
+        """
+        conditions, params = [], []
+        if old_only:
+            conditions.append(OLD_ORDERS_CONDITION)
         if instance_id is not None:
             conditions.append('hub_instance = ?' if same_instance else 'hub_instance != ?')
             params.append(instance_id)
 
+        sql = 'SELECT status, COUNT(*) AS amount FROM orders'
         if conditions:
             sql += ' WHERE ' + ' AND '.join(conditions)
 
-        cursor = await self.raw_query(sql, *params, commit=False)
-        return {
-            row['order_id']: StarsOrder.model_validate(dict(row))
-            for row in await cursor.fetchall()
-        }
+        rows = await self._read(f'{sql} GROUP BY status', *params)
+        return {StarsOrderStatus(row['status']): row['amount'] for row in rows}
 
-    async def get_ready_orders(self, instance_id: str, amount=65) -> dict[str, StarsOrder]:
-        sql = (
-            'SELECT * FROM orders '
-            "WHERE (status = 'READY' OR (status = 'ERROR' AND retries_left > 0)) AND hub_instance = ? "
-            'LIMIT ?'
+    @staticmethod
+    def _set_clause(fields: dict[str, Any]) -> tuple[str, list[Any]]:
+        if unknown := fields.keys() - UPDATABLE_COLUMNS:
+            raise ValueError(f'Unknown order fields: {", ".join(sorted(unknown))}.')
+
+        return (
+            ', '.join([*(f'{i} = ?' for i in fields), 'version = version + 1']),
+            [i.value if isinstance(i, Enum) else i for i in fields.values()],
         )
 
-        cursor = await self.raw_query(sql, instance_id, amount, commit=False)
-        return {
-            row['order_id']: StarsOrder.model_validate(dict(row))
-            for row in await cursor.fetchall()
-        }
+    async def _modify_orders(self, query: str, *args: Any) -> list[str]:
+        # Буфер записи сохраняется до запроса, иначе он перезапишет результат.
+        async with self._write_lock:
+            await self._flush()
+            cursor = await self.raw_query(query, *args, commit=False)
+            order_ids = [row['order_id'] for row in await cursor.fetchall()]
+            await self._commit()
+        return order_ids
 
-    async def get_old_orders(self, instance_id: str) -> dict[StarsOrderStatus, list[StarsOrder]]:
-        o_dict = await self.get_orders(
-            instance_id=instance_id,
-            same_instance=False,
-            status=[
-                StarsOrderStatus.WAITING_FOR_USERNAME,
-                StarsOrderStatus.ERROR,
-                StarsOrderStatus.UNPROCESSED,
-                StarsOrderStatus.READY,
-            ],
-        )
-
-        orders = [
-            i
-            for i in o_dict.values()
-            if not (i.status is StarsOrderStatus.ERROR and not i.retries_left)
-        ]
+    async def update_orders(self, *order_ids: str, **fields: Any) -> list[str]:
+        """
+        Изменяет поля заказов одним `UPDATE`. Возвращает ID измененных заказов.
+        """
+        if not order_ids or not fields:
+            return []
 
-        if not orders:
-            return {}
+        set_sql, params = self._set_clause(fields)
+        placeholders = ', '.join(['?'] * len(order_ids))
+        return await self._modify_orders(
+            f'UPDATE orders SET {set_sql} WHERE order_id IN ({placeholders}) RETURNING order_id',
+            *params,
+            *order_ids,
+        )
 
-        orders_dict = defaultdict(list)
-        for i in orders:
-            orders_dict[i.status].append(i)
+    async def update_old_orders(
+        self,
+        instance_id: str,
+        where_status: StarsOrderStatus | None = None,
+        **fields: Any,
+    ) -> list[str]:
+        """
+        Изменяет поля всех старых заказов (как в `get_old_orders`) одним `UPDATE`.
+        `where_status` - статус изменяемых заказов, `fields` может менять и сам `status`.
+        Возвращает ID измененных заказов.
+        """
+        if not fields:
+            return []
 
-        return orders_dict
+        set_sql, params = self._set_clause(fields)
+        where_sql, where_params = self._old_orders_filter(instance_id, where_status)
+        return await self._modify_orders(
+            f'UPDATE orders SET {set_sql} WHERE {where_sql} RETURNING order_id',
+            *params,
+            *where_params,
+        )
 
-    async def delete_orders(self, *order_ids: str) -> None:
+    async def delete_orders(self, *order_ids: str) -> list[str]:
         if not order_ids:
-            return
+            return []
+
+        self._writes.discard(*order_ids)
+        placeholders = ', '.join(['?'] * len(order_ids))
+        return await self._modify_orders(
+            f'DELETE FROM orders WHERE order_id IN ({placeholders}) RETURNING order_id',
+            *order_ids,
+        )
+
+    async def delete_old_orders(
+        self,
+        instance_id: str,
+        status: StarsOrderStatus | None = None,
+    ) -> list[str]:
+        where_sql, params = self._old_orders_filter(instance_id, status)
+        order_ids = await self._modify_orders(
+            f'DELETE FROM orders WHERE {where_sql} RETURNING order_id',
+            *params,
+        )
+        self._writes.discard(*order_ids)
+        return order_ids
+
+    @staticmethod
+    def _event_from_row(row: aiosqlite.Row) -> OrderEvent:
+        return OrderEvent(
+            id=row['id'],
+            order_id=row['order_id'],
+            from_status=StarsOrderStatus(row['from_status']) if row['from_status'] else None,
+            to_status=StarsOrderStatus(row['to_status']),
+            error=ErrorTypes(row['error']) if row['error'] else None,
+            created_at=row['created_at'],
+            latency=row['latency'],
+        )
+
+    @staticmethod
+    def _time_range(since: float | None, until: float | None) -> tuple[str, list[float]]:
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('created_at < ?')
+            params.append(until)
+        return (f' WHERE {" AND ".join(conditions)}' if conditions else ''), params
+
+    async def get_order_events(self, order_id: str) -> list[OrderEvent]:
+        rows = await self._read(
+            'SELECT * FROM order_events WHERE order_id = ? ORDER BY id',
+            order_id,
+        )
+        return [self._event_from_row(row) for row in rows]
+
+    async def get_events(
+        self,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int | None = None,
+    ) -> list[OrderEvent]:
+        where, params = self._time_range(since, until)
+        sql = f'SELECT * FROM order_events{where} ORDER BY created_at, id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        return [self._event_from_row(row) for row in await self._read(sql, *params)]
+
+    async def get_stage_latencies(
+        self,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> dict[tuple[StarsOrderStatus | None, StarsOrderStatus], list[float]]:
+        """
+        Время, проведенное заказами в каждом статусе, по переходам `(from_status, to_status)`.
+        """
+        where, params = self._time_range(since, until)
+        where += ' AND latency IS NOT NULL' if where else ' WHERE latency IS NOT NULL'
+        rows = await self._read(
+            f'SELECT from_status, to_status, latency FROM order_events{where} '
+            'ORDER BY from_status, to_status, latency',
+            *params,
+        )
+
+        result = defaultdict(list)
+        for row in rows:
+            stage = (
+                StarsOrderStatus(row['from_status']) if row['from_status'] else None,
+                StarsOrderStatus(row['to_status']),
+            )
+            result[stage].append(row['latency'])
+        return dict(result)
 
-        place_holders = ', '.join(['?'] * len(order_ids))
-        sql = f'DELETE FROM orders WHERE order_id IN ({place_holders})'
-        await self.raw_query(sql, *order_ids, commit=True)
+    async def get_sales_stats(
+        self,
+        since: float,
+        until: float | None = None,
+        period: Literal['hour', 'day'] = 'day',
+    ) -> list[SalesStats]:
+        """
+        Статистика продаж из `order_stats` по часам или дням (UTC).
+        Читает только строки за период, поэтому не зависит от кол-ва заказов в базе.
+        """
+        size = 3600 if period == 'hour' else 86400
+        sql = (
+            f'SELECT (hour / {size}) * {size} AS period_start, status, SUM(orders) AS orders, '
+            'SUM(stars_amount) AS stars_amount, SUM(ton_amount) AS ton_amount '
+            'FROM order_stats WHERE hour >= ?'
+        )
+        params = [int(since) // 3600 * 3600]
+        if until is not None:
+            sql += ' AND hour < ?'
+            params.append(int(until))
+
+        rows = await self._read(f'{sql} GROUP BY 1, 2 ORDER BY 1, 2', *params)
+        return [
+            SalesStats(
+                period_start=row['period_start'],
+                status=StarsOrderStatus(row['status']),
+                orders=row['orders'],
+                stars_amount=row['stars_amount'],
+                ton_amount=row['ton_amount'],
+            )
+            for row in rows
+        ]
+
+    async def get_recipient(self, username: str) -> CachedRecipient | None:
+        rows = await self._read('SELECT * FROM recipients WHERE username = ?', username)
+        if not rows:
+            return None
+
+        data = rows[0]
+
+        return CachedRecipient(
+            username=data['username'],
+            recipient_id=data['recipient_id'],
+            error=ErrorTypes(data['error']) if data['error'] else None,
+            expires_at=data['expires_at'],
+        )
+
+    async def save_recipient(self, recipient: CachedRecipient) -> None:
+        await self.raw_query(
+            'INSERT OR REPLACE INTO recipients (username, recipient_id, error, expires_at) '
+            'VALUES (?, ?, ?, ?)',
+            recipient.username,
+            recipient.recipient_id,
+            recipient.error.value if recipient.error else None,
+            recipient.expires_at,
+        )
 
     async def raw_query(
         self,
@@ -224,10 +1350,17 @@ class Sqlite3Storage(Storage):
         cursor: Cursor | None = None,
         commit: bool = True,
     ) -> Cursor:
+        """
+        Выполняет запрос на соединении записи.
+        С `commit=True` запрос и коммит выполняются под блокировкой записи.
+        """
         cursor = cursor if cursor is not None else self._conn
-        cursor = await cursor.execute(query, args)
-        if commit:
-            await self._conn.commit()
+        if not commit:
+            return await cursor.execute(query, args)
+
+        async with self._write_lock:
+            cursor = await cursor.execute(query, args)
+            await self._commit()
         return cursor
 
     @property
@@ -235,7 +1368,7 @@ class Sqlite3Storage(Storage):
         return self._path
 
     @classmethod
-    async def from_path(cls, path: str | Path) -> Self:
-        storage = Sqlite3Storage(path)
+    async def from_path(cls, path: str | Path, **kwargs: Any) -> Self:
+        storage = cls(path, **kwargs)
         await storage.setup()
         return storage
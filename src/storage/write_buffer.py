@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+
+__all__ = ['PendingWrite', 'WriteBuffer']
+
+
+from typing import TYPE_CHECKING, Any
+from dataclasses import field, dataclass
+
+
+if TYPE_CHECKING:
+    from autostars.src.types import StarsOrder
+
+
+@dataclass
+class PendingWrite:
+    order_id: str
+    row: dict[str, Any]
+    insert: bool
+    durable: bool = False
+    expected_version: int | None = None  # версия заказа в базе до этой записи
+    # Модели, которым после коммита записи нужно выставить новую версию.
+    orders: list[StarsOrder] = field(default_factory=list)
+
+    def merge(self, other: PendingWrite) -> None:
+        """
+        Накладывает более позднюю запись того же заказа на эту.
+        """
+        self.row.update(other.row)
+        self.insert = self.insert or other.insert
+        self.durable = self.durable or other.durable
+        self.orders.extend(i for i in other.orders if not self.has_order(i))
+
+    def has_order(self, order: StarsOrder) -> bool:
+        return any(i is order for i in self.orders)
+
+
+class WriteBuffer:
+    """
+    Несохраненные изменения заказов.
+    Изменения одного заказа объединяются в одну запись до следующего сброса в базу.
+    """
+
+    def __init__(self) -> None:
+        self._pending: dict[str, PendingWrite] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, order_id: str) -> bool:
+        return order_id in self._pending
+
+    @property
+    def durable(self) -> bool:
+        return any(i.durable for i in self._pending.values())
+
+    def add(
+        self,
+        order_id: str,
+        row: dict[str, Any],
+        insert: bool,
+        durable: bool = False,
+        expected_version: int | None = None,
+        order: StarsOrder | None = None,
+    ) -> bool:
+        """
+        Добавляет запись заказа. Возвращает `False` (и ничего не добавляет), если в буфере
+        уже есть запись этого заказа, сделанная через другую его копию: копии, загруженные
+        до этой записи, устарели.
+        """
+        write = PendingWrite(
+            order_id=order_id,
+            row=dict(row),
+            insert=insert,
+            durable=durable,
+            expected_version=expected_version,
+            orders=[order] if order is not None else [],
+        )
+        if (pending := self._pending.get(order_id)) is None:
+            self._pending[order_id] = write
+            return True
+
+        if expected_version is not None and (
+            expected_version != pending.expected_version
+            or order is None
+            or not pending.has_order(order)
+        ):
+            return False
+        pending.merge(write)
+        return True
+
+    def rebase(self, committed: PendingWrite) -> None:
+        """
+        Переносит на сохраненную версию `committed` запись того же заказа, добавленную
+        через те же модели, пока `committed` сохранялась.
+        """
+        pending = self._pending.get(committed.order_id)
+        if (
+            pending is None
+            or pending.expected_version != committed.expected_version
+            or not any(committed.has_order(i) for i in pending.orders)
+        ):
+            return
+        pending.expected_version = committed.row['version']
+        pending.row['version'] = pending.expected_version + 1
+
+    def discard(self, *order_ids: str) -> None:
+        for i in order_ids:
+            self._pending.pop(i, None)
+
+    def take(self) -> list[PendingWrite]:
+        writes, self._pending = list(self._pending.values()), {}
+        return writes
+
+    def restore(self, writes: list[PendingWrite]) -> None:
+        """
+        Возвращает в буфер записи, которые не удалось сохранить.
+        Изменения, добавленные после `take`, остаются поверх них.
+        """
+        pending, self._pending = self._pending, {i.order_id: i for i in writes}
+        for order_id, write in pending.items():
+            if order_id in self._pending:
+                self._pending[order_id].merge(write)
+            else:
+                self._pending[order_id] = write
@@ -1,15 +1,23 @@
 from __future__ import annotations
 
+import os
 import re
+import time
+import tempfile
 from typing import TYPE_CHECKING
+from datetime import UTC, datetime
+from collections import defaultdict
 
 from aiogram import Router
+from aiogram.types import FSInputFile
 from aiogram.filters import Command
 from autostars.src.telegram import (
     states,
     callbacks as cbs,
 )
+from autostars.src.storage import OrderFilter
 from autostars.src.types.enums import StarsOrderStatus
+from autostars.src.storage.export import EXPORT_FORMATS, export_orders
 from autostars.src.autostars_provider import AutostarsProvider
 from autostars.src.telegram.ui.context import StarsOrderMenuContext
 
@@ -24,9 +32,11 @@ from funpayhub.app.telegram.ui.builders.context import StateUIContext
 if TYPE_CHECKING:
     from aiogram.types import Message
     from aiogram.filters import CommandObject
+    from autostars.src.types import SalesStats
     from autostars.src.storage import Storage
     from aiogram.fsm.context import FSMContext as FSM
     from funpayhub.app.main import FunPayHub as FPH
+    from autostars.src.transferer_service import TransferrerService
 
 
 router = Router(name='autostars')
@@ -72,7 +82,11 @@ async def order_info2(m: Message, autostars_storage: Storage, state: FSM):
 
 @router.message(Command('stars_old_orders'))
 async def list_old_orders(m: Message, autostars_provider: AutostarsProvider, hub: FPH):
-    orders = await autostars_provider.storage.get_old_orders(hub.instance_id)
+    orders = await autostars_provider.storage.count_orders_by_status(
+        hub.instance_id,
+        same_instance=False,
+        old_only=True,
+    )
     if not orders:
         return m.answer(ru('<b>✅ Нет незаконченных заказов с прошлых запусков.</b>'))
     await MenuContext(menu_id='autostars:old_orders', trigger=m).answer_to()
@@ -83,6 +97,86 @@ async def stars_status(message: Message):
     await MenuContext(menu_id='autostars:status', trigger=message).answer_to()
 
 
+@router.message(Command('stars_export'))
+async def export(m: Message, autostars_storage: Storage, command: CommandObject):
+    # /stars_export [csv|ndjson] [кол-во дней]
+    args = (command.args or '').split()
+    fmt = args[0].lower() if args and not args[0].isdigit() else 'csv'
+    days = next((int(i) for i in args if i.isdigit()), None)
+    if fmt not in EXPORT_FORMATS:
+        text = ru(
+            '<b>❌ Неизвестный формат. Доступные форматы: {formats}.</b>',
+            formats=', '.join(EXPORT_FORMATS),
+        )
+        await m.answer(text)
+        return
+
+    order_filter = OrderFilter(
+        since=time.time() - days * 86400 if days else None,
+        archived=True,
+    )
+    fd, path = tempfile.mkstemp(prefix='autostars_orders_', suffix=f'.{fmt}')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+            count = await export_orders(autostars_storage, file, fmt, order_filter)
+
+        if not count:
+            await m.answer(ru('<b>🤷 Нет заказов за указанный период.</b>'))
+            return
+
+        await m.answer_document(
+            FSInputFile(path, filename=f'autostars_orders.{fmt}'),
+            caption=ru('<b>📦 Выгружено заказов: {count}.</b>', count=count),
+        )
+    finally:
+        os.unlink(path)
+
+
+SOLD_STATUSES = (StarsOrderStatus.DONE, StarsOrderStatus.FORCE_DONE)
+REFUNDED_STATUSES = (StarsOrderStatus.REFUNDED, StarsOrderStatus.FORCE_REFUNDED)
+
+
+def _format_sales_stats(stats: list[SalesStats]) -> str:
+    sold, stars, ton = 0, 0, 0
+    failed, refunded = 0, 0
+    for i in stats:
+        if i.status in SOLD_STATUSES:
+            sold, stars, ton = sold + i.orders, stars + i.stars_amount, ton + i.ton_amount
+        elif i.status is StarsOrderStatus.ERROR:
+            failed += i.orders
+        elif i.status in REFUNDED_STATUSES:
+            refunded += i.orders
+
+    return ru(
+        '✅ {sold} | ⭐ {stars} | 💎 {ton} TON | ❌ {failed} | ↩️ {refunded}',
+        sold=sold,
+        stars=stars,
+        ton=f'{ton / 1_000_000_000:.2f}',
+        failed=failed,
+        refunded=refunded,
+    )
+
+
+@router.message(Command('stars_stats'))
+async def stars_stats(m: Message, autostars_storage: Storage, command: CommandObject):
+    # /stars_stats [кол-во дней]
+    days = int(command.args) if command.args and command.args.strip().isdigit() else 7
+    days = min(max(days, 1), 90)
+
+    today = int(time.time()) // 86400 * 86400
+    stats = await autostars_storage.get_sales_stats(today - (days - 1) * 86400)
+    by_day: dict[int, list[SalesStats]] = defaultdict(list)
+    for i in stats:
+        by_day[i.period_start].append(i)
+
+    lines = [ru('<b>📊 Статистика продаж за {days} дн. (UTC)</b>', days=days), '']
+    for day in range(today, today - days * 86400, -86400):
+        date = datetime.fromtimestamp(day, UTC).strftime('%d.%m')
+        lines.append(f'<code>{date}</code>: {_format_sales_stats(by_day.get(day, []))}')
+    lines.extend(['', ru('<b>Всего</b>: {total}', total=_format_sales_stats(stats))])
+    await m.answer('\n'.join(lines))
+
+
 # -----------------------------------------------------
 # ------------------ Mark-as Commands -----------------
 # -----------------------------------------------------
@@ -100,7 +194,6 @@ actions = {
     states.Action.dont_ignore: {
         'done_text': '<b>✅ Заказы {orders} теперь не игнорируются плагином.</b>',
         'not_found_text': '<b>⚠️ Не удалось найти заказы {orders}.</b>',
-        'instance_id': getattr(__builtins__, 'APP_INSTANCE_ID', 'EMPTY_INSTANCE')
     },
 }
 
@@ -124,18 +217,15 @@ async def _mark_orders(
     done_text: str = '',
     not_found_text: str = '',
 ) -> str:
-    orders = await storage.get_orders(*order_ids)
-    done = []
+    fields = {}
+    if status is not None:
+        fields['status'] = status
+    if instance_id is not None:
+        fields['hub_instance'] = instance_id
 
-    for order in orders.values():
-        if status is not None:
-            order.status = status
-        if instance_id is not None:
-            order.instance_id = instance_id
-        done.append(order.order_id)
-
-    await storage.add_or_update_orders(*orders.values())
+    done = set(await storage.update_orders(*order_ids, **fields))
     not_found = [i for i in order_ids if i not in done]
+    done = [i for i in order_ids if i in done]
 
     text = ''
     if done:
@@ -146,6 +236,23 @@ async def _mark_orders(
     return text.strip()
 
 
+async def _apply_action(
+    action: states.Action,
+    order_ids: list[str],
+    storage: Storage,
+    service: TransferrerService,
+    hub: FPH,
+) -> str:
+    kwargs = dict(actions[action])
+    if action is states.Action.dont_ignore:
+        kwargs['instance_id'] = hub.instance_id
+
+    text = await _mark_orders(order_ids, storage, **kwargs)
+    if action is states.Action.dont_ignore:
+        service.notify()
+    return text
+
+
 async def _set_state(
     m: Message,
     state: FSM,
@@ -169,11 +276,24 @@ async def _set_state(
 @router.message(Command('stars_mark_done'))
 @router.message(Command('stars_mark_refunded'))
 @router.message(Command('stars_dont_ignore'))
-async def mark_done(m: Message, autostars_storage: Storage, state: FSM, command: CommandObject):
+async def mark_done(
+    m: Message,
+    autostars_storage: Storage,
+    autostars_service: TransferrerService,
+    hub: FPH,
+    state: FSM,
+    command: CommandObject,
+):
     if not (ids := await _set_state(m, state, cmds[command.command])):
         return
 
-    text = await _mark_orders(ids, autostars_storage, **actions[cmds[command.command]])
+    text = await _apply_action(
+        cmds[command.command],
+        ids,
+        autostars_storage,
+        autostars_service,
+        hub,
+    )
     await m.answer(text)
 
 
@@ -182,12 +302,18 @@ async def delete(m: Message, autostars_storage: Storage, state: FSM):
     if not (ids := await _set_state(m, state, states.Action.dont_ignore)):
         return
 
-    await autostars_storage.delete_orders(*ids)
-    await m.answer(ru('<b>🗑️ Заказы {orders} удалены.</b>', orders=ids))
+    deleted = await autostars_storage.delete_orders(*ids)
+    await m.answer(ru('<b>🗑️ Заказы {orders} удалены.</b>', orders=deleted))
 
 
 @router.message(states.OrdersActionState.filter(), lambda message: message.text)
-async def do_orders_action(m: Message, autostars_storage: Storage, state: FSM):
+async def do_orders_action(
+    m: Message,
+    autostars_storage: Storage,
+    autostars_service: TransferrerService,
+    hub: FPH,
+    state: FSM,
+):
     obj = await states.OrdersActionState.get(state)
     await states.OrdersActionState.clear(state)
 
@@ -197,10 +323,16 @@ async def do_orders_action(m: Message, autostars_storage: Storage, state: FSM):
         return
 
     if obj.action in (states.Action.mark_done, states.Action.mark_refunded, states.Action.dont_ignore):
-        text = await _mark_orders(order_ids, autostars_storage, **actions[obj.action])
+        text = await _apply_action(
+            obj.action,
+            order_ids,
+            autostars_storage,
+            autostars_service,
+            hub,
+        )
     elif obj.action is states.Action.delete:
-        await autostars_storage.delete_orders(*order_ids)
-        text = ru('<b>🗑️ Заказы {orders} удалены.</b>', orders=order_ids)
+        deleted = await autostars_storage.delete_orders(*order_ids)
+        text = ru('<b>🗑️ Заказы {orders} удалены.</b>', orders=deleted)
     else:
         text = ru('❌ Неизвестное действие. Отправьте это сообщение разработчику.')
 
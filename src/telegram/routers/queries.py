@@ -14,6 +14,7 @@ from funpayhub.lib.translater import translater
 if TYPE_CHECKING:
     from aiogram.types import CallbackQuery as Query
     from funpayhub.app.main import FunPayHub as FPH
+    from autostars.src.transferer_service import TransferrerService
 
 
 router = Router(name='autostars:queries')
@@ -32,37 +33,43 @@ async def old_orders_action(
     q: Query,
     cbd: cbs.OldOrdersAction,
     autostars_provider: AutostarsProvider,
+    autostars_service: TransferrerService,
     hub: FPH,
     tg_ui: UIRegistry
 ):
-    orders_dict = await autostars_provider.storage.get_old_orders(hub.instance_id)
-    orders = orders_dict.get(cbd.status, [])
+    storage = autostars_provider.storage
     st = translater.translate(cbd.status.desc).lower()
-    if not orders:
-        return q.answer(ru('✅ Нет старых заказов со статусом "{s}".', s=st), show_alert=True)
 
     messages = {
         'dont_ignore': ru('✅ Заказы со статусом "{s}" теперь не игнорируются.', s=st),
         'mark_done': ru('✅ Заказы со статусом "{s}" помечены как выполненные.', s=st),
-        'mark_refunded': ru('✅ Заказы со статусом "{status}" помечены как возвращенные.', s=st),
-        'delete': ru('🗑️ Старые заказы со статусом "{status}" удалены.', s=st)
+        'mark_refunded': ru('✅ Заказы со статусом "{s}" помечены как возвращенные.', s=st),
+        'delete': ru('🗑️ Старые заказы со статусом "{s}" удалены.', s=st)
     }
     msg = messages.get(cbd.action, ru('Действие выполнено но разраб забыл добавить сообщение ._.'))
 
     actions = {
-        'dont_ignore': lambda o: setattr(o, 'hub_instance', hub.instance_id),
-        'mark_done': lambda o: setattr(o, 'status', StarsOrderStatus.FORCE_DONE),
-        'mark_refunded': lambda o: setattr(o, 'status', StarsOrderStatus.FORCE_REFUNDED),
+        'dont_ignore': {'hub_instance': hub.instance_id},
+        'mark_done': {'status': StarsOrderStatus.FORCE_DONE},
+        'mark_refunded': {'status': StarsOrderStatus.FORCE_REFUNDED},
     }
 
     if cbd.action in actions:
-        for i in orders:
-            actions[cbd.action](i)
-        await autostars_provider.storage.add_or_update_orders(*orders)
+        orders = await storage.update_old_orders(
+            hub.instance_id,
+            where_status=cbd.status,
+            **actions[cbd.action],
+        )
     elif cbd.action == 'delete':
-        await autostars_provider.storage.delete_orders(*(i.order_id for i in orders))
+        orders = await storage.delete_old_orders(hub.instance_id, cbd.status)
     else:
         return q.answer(ru('❌ Неизвестное действие.'))
 
+    if not orders:
+        return q.answer(ru('✅ Нет старых заказов со статусом "{s}".', s=st), show_alert=True)
+
+    if cbd.action == 'dont_ignore':
+        autostars_service.notify()
+
     await q.answer(msg, show_alert=True)
     await tg_ui.context_from_history(cbd.ui_history, trigger=q).apply_to()
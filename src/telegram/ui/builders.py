@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import html
 import math
-from functools import reduce
 from typing import TYPE_CHECKING
 
 from autostars.src.types.enums import (
@@ -133,13 +132,24 @@ class StatusMenuBuilder(
         else:
             menu.main_text += '❌ <b>Fragment: не подключен.</b>\n'
 
+        limiter = autostars_provider.tonapi.session.limiter
+        menu.main_text += (
+            f'⏱️ <b>Ожидание лимита TonAPI: в среднем <code>{limiter.average_wait:.2f}</code> с, '
+            f'максимум <code>{limiter.max_wait:.2f}</code> с '
+            f'(<code>{limiter.rate:.2f}</code> запр./с).</b>\n'
+        )
+
         return menu
 
 
 class OldOrdersMenuBuilder(MenuBuilder, menu_id='autostars:old_orders', context_type=MenuContext):
     async def build(self, ctx: MenuContext, hub: FPH, autostars_provider: AutostarsProvider) -> Menu:
         menu = Menu(finalizer=StripAndNavigationFinalizer())
-        old_orders = await autostars_provider.storage.get_old_orders(hub.instance_id)
+        old_orders = await autostars_provider.storage.count_orders_by_status(
+            hub.instance_id,
+            same_instance=False,
+            old_only=True,
+        )
 
         if not old_orders:
             menu.main_text = ru(
@@ -147,7 +157,7 @@ class OldOrdersMenuBuilder(MenuBuilder, menu_id='autostars:old_orders', context_
             )
             return menu
 
-        total_len = reduce(lambda x, y: x + len(y), old_orders.values(), 0)
+        total_len = sum(old_orders.values())
         menu.main_text = ru(
             '<b>⚠️ Обнаружены заказы (<code>{orders_amount}</code>), которые были инициированы во время'
             ' предыдущего запуска FunPayHub, но так и не были завершены.</b>\n\n',
@@ -158,7 +168,7 @@ class OldOrdersMenuBuilder(MenuBuilder, menu_id='autostars:old_orders', context_
             menu.main_text += ru(
                 '<b>🔘 Необработанные заказы (<code>{orders_amount}</code>)</b> были сохранены '
                 'в базу данных, но для них даже не была выполнена проверка Telegram юзернейма.\n\n',
-                orders_amount=len(old_orders[StarsOrderStatus.UNPROCESSED]),
+                orders_amount=old_orders[StarsOrderStatus.UNPROCESSED],
             )
             menu.main_keyboard.add_callback_button(
                 button_id='open_unprocessed_orders',
@@ -174,7 +184,7 @@ class OldOrdersMenuBuilder(MenuBuilder, menu_id='autostars:old_orders', context_
                 '<b>⏳ Заказы, ожидающие ввод валидного Telegram юзернейма (<code>{orders_amount}</code>),</b> '
                 'были созданы, но юзернеймы, которые передали покупатели, либо невалидны, '
                 'либо не были найдены.\n\n',
-                orders_amount=len(old_orders[StarsOrderStatus.WAITING_FOR_USERNAME]),
+                orders_amount=old_orders[StarsOrderStatus.WAITING_FOR_USERNAME],
             )
             menu.main_keyboard.add_callback_button(
                 button_id='open_waiting_username_orders',
@@ -189,7 +199,7 @@ class OldOrdersMenuBuilder(MenuBuilder, menu_id='autostars:old_orders', context_
             menu.main_text += ru(
                 '<b>⚡ Заказы, готовые к выполнению (<code>{orders_amount}</code>)</b>, '
                 'полностью валидны, но до них так и не дошла очередь.\n\n',
-                orders_amount=len(old_orders[StarsOrderStatus.READY]),
+                orders_amount=old_orders[StarsOrderStatus.READY],
             )
             menu.main_keyboard.add_callback_button(
                 button_id='open_ready_orders',
@@ -204,7 +214,7 @@ class OldOrdersMenuBuilder(MenuBuilder, menu_id='autostars:old_orders', context_
             menu.main_text += ru(
                 '<b>⁉️ Заказы, по которым не удалось выполнить транзакцию '
                 '(<code>{orders_amount}</code>)</b>, но у них есть еще несколько попыток.\n\n',
-                orders_amount=len(old_orders[StarsOrderStatus.ERROR]),
+                orders_amount=old_orders[StarsOrderStatus.ERROR],
             )
             menu.main_keyboard.add_callback_button(
                 button_id='open_errored_orders',
@@ -231,10 +241,10 @@ class OldOrdersListMenuBuilder(
 ):
     async def build(self, ctx: OldOrdersListMenuContext, hub: FPH, autostars_provider: AutostarsProvider) -> Menu:
         menu = Menu(finalizer=StripAndNavigationFinalizer())
-        orders = await autostars_provider.storage.get_old_orders(hub.instance_id)
-        orders = orders.get(ctx.orders_status) or []
+        storage = autostars_provider.storage
+        total = await storage.count_old_orders(hub.instance_id, ctx.orders_status)
 
-        if not orders:
+        if not total:
             menu.header_text = ru(
                 '<b>Нет заказов с прошлых запусков со статусом <i><u>{status}</u></i></b>',
                 status=translater.translate(ctx.orders_status.desc).lower()
@@ -246,8 +256,12 @@ class OldOrdersListMenuBuilder(
             status=ru(ctx.orders_status.desc).lower(),
         )
 
-        curr_orders = orders[ctx.view_page * 50 : (ctx.view_page + 1) * 50]
-        menu.header_keyboard = await build_view_navigation_btns(ctx, math.ceil(len(orders) / 50))
+        after, curr_orders = await self.load_page(ctx, hub, autostars_provider)
+        ctx.cursor_page, ctx.page_after = ctx.view_page, after
+        ctx.first_order_id = curr_orders[0].order_id if curr_orders else None
+        ctx.last_order_id = curr_orders[-1].order_id if curr_orders else None
+
+        menu.header_keyboard = await build_view_navigation_btns(ctx, math.ceil(total / 50))
         menu.main_text = '\n'.join(self.gen_order_text(i) for i in curr_orders)
         menu.footer_text = ru('🛠️ Выберите, что делать с заказами.')
 
@@ -297,6 +311,50 @@ class OldOrdersListMenuBuilder(
 
         return menu
 
+    async def load_page(
+        self,
+        ctx: OldOrdersListMenuContext,
+        hub: FPH,
+        autostars_provider: AutostarsProvider,
+    ) -> tuple[str | None, list[StarsOrder]]:
+        """
+        Возвращает курсор `after` страницы `ctx.view_page` и ее заказы.
+        Соседние страницы читаются от крайних заказов прошлой страницы, OFFSET нужен
+        только при переходе сразу на дальнюю страницу.
+        """
+        storage = autostars_provider.storage
+        page = ctx.view_page
+
+        if page > 0 and ctx.cursor_page == page + 1 and ctx.first_order_id is not None:
+            orders = await storage.get_old_orders_page(
+                hub.instance_id,
+                ctx.orders_status,
+                before=ctx.first_order_id,
+                limit=51,
+            )
+            return (orders[0].order_id if len(orders) > 50 else None), orders[-50:]
+
+        if page == 0:
+            after = None
+        elif ctx.cursor_page == page:
+            after = ctx.page_after
+        elif ctx.cursor_page == page - 1 and ctx.last_order_id is not None:
+            after = ctx.last_order_id
+        else:
+            after = await storage.get_old_orders_cursor(
+                hub.instance_id,
+                ctx.orders_status,
+                page * 50,
+            )
+
+        orders = await storage.get_old_orders_page(
+            hub.instance_id,
+            ctx.orders_status,
+            after=after,
+            limit=50,
+        )
+        return after, orders
+
     def gen_order_text(self, order: StarsOrder):
         return ru(
             '<b><a href="https://funpay.com/orders/{order_id}/">{order_id}</a> | '
@@ -22,6 +22,11 @@ class StarsOrderMenuContext(MenuContext):
 
 class OldOrdersListMenuContext(MenuContext):
     orders_status: StarsOrderStatus
+    # Последняя показанная страница: соседние страницы читаются от ее крайних заказов.
+    cursor_page: int | None = None
+    page_after: str | None = None
+    first_order_id: str | None = None
+    last_order_id: str | None = None
 
 
 class OrdersListMenuContext(MenuContext):
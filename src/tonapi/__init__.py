@@ -1,13 +1,13 @@
 from __future__ import annotations
 
 
-__all__ = ['TonAPI']
+__all__ = ['TonAPI', 'ConfirmationTracker']
 
-import time
 from typing import TYPE_CHECKING
 
 from .methods import GetSeqno, GetWallet, SendMessage, GetTransactionByMessageHash
 from .session import Session
+from .tracker import ConfirmationTracker
 
 
 if TYPE_CHECKING:
@@ -15,9 +15,10 @@ if TYPE_CHECKING:
 
 
 class TonAPI:
-    def __init__(self, token: str | None = None):
-        self._session = Session(token=token)
+    def __init__(self, token: str | None = None, rps: float | None = None):
+        self._session = Session(token=token, rps=rps)
         self._token = token
+        self._tracker = ConfirmationTracker(self)
 
     async def get_seqno(self, address: str) -> Seqno:
         return await self.session.make_request(GetSeqno(address=address))
@@ -32,20 +33,16 @@ class TonAPI:
         return await self.session.make_request(GetTransactionByMessageHash(message_hash=hash))
 
     async def wait_for_transfer(self, msg_hash: str, valid_until: int) -> Transaction:
-        while True:
-            request_time = time.time()
-            try:
-                return await self.get_transaction_by_msg_hash(msg_hash)
-            except Exception:  # todo: log unexpected exceptions
-                pass
-
-            if request_time > valid_until:
-                raise TimeoutError('Timeout waiting for transfer.')
+        return await self.tracker.wait(msg_hash, valid_until)
 
     @property
     def session(self) -> Session:
         return self._session
 
+    @property
+    def tracker(self) -> ConfirmationTracker:
+        return self._tracker
+
     @property
     def token(self) -> str | None:
         return self._token
@@ -54,3 +51,11 @@ class TonAPI:
     def token(self, token: str | None) -> None:
         self._token = token
         self._session.token = token
+
+    @property
+    def rps(self) -> float | None:
+        return self._session.rps
+
+    @rps.setter
+    def rps(self, rps: float | None) -> None:
+        self._session.rps = rps
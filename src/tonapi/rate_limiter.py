@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+
+__all__ = ['TokenBucket']
+
+
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Token bucket: запросы выполняются параллельно, но не чаще `rate` в секунду
+    (с накоплением до `capacity` запросов).
+
+    Лок держится только на время получения токена, а не на время запроса.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def capacity(self) -> float:
+        return self._capacity
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.acquired if self.acquired else 0.0
+
+    def configure(self, rate: float, capacity: float = 1) -> None:
+        self._refill()
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = min(self._tokens, capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    async def acquire(self) -> float:
+        """
+        Ждет свободный токен. Возвращает время ожидания в секундах.
+        """
+        started_at = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+        waited = time.monotonic() - started_at
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.last_wait = waited
+        return waited
@@ -1,30 +1,67 @@
 from __future__ import annotations
 
-import time
-import asyncio
 from json import JSONDecodeError
 
 from aiohttp import TCPConnector, ClientSession, ClientResponseError
 from pydantic import BaseModel, ValidationError
-from asyncio import Lock
 from typing import Any
 
 from .methods import TonAPIMethod
 from .exceptions import TonAPIError, TonAPIParsingError, TonAPIUnexpectedStatus
+from .rate_limiter import TokenBucket
 from autostars.src.logger import logger
 
 
+ANONYMOUS_RPS = 1 / 4.1
+TOKEN_RPS = 1 / 1.1
+
+
 class Session:
-    def __init__(self, session: ClientSession | None = None, token: str | None = None) -> None:
-        self.token = token
+    def __init__(
+        self,
+        session: ClientSession | None = None,
+        token: str | None = None,
+        rps: float | None = None,
+    ) -> None:
         self._session = session
         self._connector: TCPConnector | None = None
-        self._last_request_ts: int | float = 0
         self._headers = {
             'Accept': '*/*',
             'Content-Type': 'application/json',
         }
-        self._requesting_lock = Lock()
+        self._limiter = TokenBucket(ANONYMOUS_RPS)
+        self._token = token
+        self._rps = rps
+        self._configure_limiter()
+
+    @property
+    def token(self) -> str | None:
+        return self._token
+
+    @token.setter
+    def token(self, token: str | None) -> None:
+        self._token = token
+        self._configure_limiter()
+
+    @property
+    def rps(self) -> float | None:
+        """
+        Лимит запросов в секунду. `None` - лимит по тарифу (с токеном или без).
+        """
+        return self._rps
+
+    @rps.setter
+    def rps(self, rps: float | None) -> None:
+        self._rps = rps
+        self._configure_limiter()
+
+    @property
+    def limiter(self) -> TokenBucket:
+        return self._limiter
+
+    def _configure_limiter(self) -> None:
+        rate = self._rps or (TOKEN_RPS if self._token else ANONYMOUS_RPS)
+        self._limiter.configure(rate, capacity=max(1.0, rate))
 
     async def session(self) -> ClientSession:
         if not self._session or self._session.closed:
@@ -48,9 +85,8 @@ class Session:
         await self.close()
 
     async def _make_request[ReturnT](self, method: TonAPIMethod[ReturnT]) -> ReturnT:
-        interval = 4.1 if not self.token else 1.1
-        if time.monotonic() - self._last_request_ts < interval:
-            await asyncio.sleep(interval - (time.monotonic() - self._last_request_ts))
+        if (waited := await self._limiter.acquire()) > 1:
+            logger.debug('Запрос к %s ждал лимита TonAPI %.2f с.', method.get_path(), waited)
 
         session = await self.session()
         data = method.model_dump_json(by_alias=True)
@@ -68,7 +104,6 @@ class Session:
 
         logger.info('Выполняю %s запрос к %s.', method.method, method.get_path())
         async with call as r:
-            self._last_request_ts = time.monotonic()
             try:
                 r.raise_for_status()
             except ClientResponseError as e:
@@ -96,8 +131,7 @@ class Session:
 
     async def make_request[ReturnT](self, method: TonAPIMethod[ReturnT]) -> ReturnT:
         try:
-            async with self._requesting_lock:
-                return await self._make_request(method)
+            return await self._make_request(method)
         except TonAPIError:
             raise
         except Exception as e:
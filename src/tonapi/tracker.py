@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+
+__all__ = ['ConfirmationTracker']
+
+
+import time
+import asyncio
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+
+from autostars.src.logger import logger
+
+from .exceptions import TonAPIUnexpectedStatus
+
+
+if TYPE_CHECKING:
+    from . import TonAPI
+    from .types import Transaction
+
+
+@dataclass
+class _PendingMessage:
+    future: asyncio.Future[Transaction]
+    valid_until: int
+    next_check: float
+    interval: float
+
+
+class ConfirmationTracker:
+    """
+    Один фоновый цикл, который проверяет все ожидаемые in_msg_hash по очереди.
+
+    Интервал проверки каждого хэша растет от `min_interval` до `max_interval`,
+    поэтому N неподтвержденных переводов не превращаются в N циклов запросов к TonAPI.
+    """
+
+    def __init__(
+        self,
+        api: TonAPI,
+        min_interval: float = 1,
+        max_interval: float = 10,
+        backoff: float = 1.5,
+    ) -> None:
+        self._api = api
+        self._pending: dict[str, _PendingMessage] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def track(self, msg_hash: str, valid_until: int) -> asyncio.Future[Transaction]:
+        if (pending := self._pending.get(msg_hash)) is not None:
+            pending.valid_until = max(pending.valid_until, valid_until)
+            return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg_hash] = _PendingMessage(
+            future=future,
+            valid_until=valid_until,
+            next_check=time.time(),
+            interval=self.min_interval,
+        )
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return future
+
+    async def wait(self, msg_hash: str, valid_until: int) -> Transaction:
+        # shield: отмена одного ожидающего не должна отменять результат для остальных.
+        return await asyncio.shield(self.track(msg_hash, valid_until))
+
+    async def _run(self) -> None:
+        while self._pending:
+            msg_hash, pending = min(self._pending.items(), key=lambda x: x[1].next_check)
+            delay = pending.next_check - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            await self._check(msg_hash, pending)
+        self._task = None
+
+    async def _check(self, msg_hash: str, pending: _PendingMessage) -> None:
+        request_time = time.time()
+        try:
+            transaction = await self._api.get_transaction_by_msg_hash(msg_hash)
+        except TonAPIUnexpectedStatus as e:
+            if e.status != 404:
+                logger.warning('Ошибка проверки транзакции %s.', msg_hash, exc_info=True)
+        except Exception:
+            logger.warning('Ошибка проверки транзакции %s.', msg_hash, exc_info=True)
+        else:
+            del self._pending[msg_hash]
+            if not pending.future.done():
+                pending.future.set_result(transaction)
+            return
+
+        if request_time >= pending.valid_until:
+            del self._pending[msg_hash]
+            if not pending.future.done():
+                pending.future.set_exception(TimeoutError('Timeout waiting for transfer.'))
+            return
+
+        pending.interval = min(pending.interval * self.backoff, self.max_interval)
+        pending.next_check = min(time.time() + pending.interval, pending.valid_until)
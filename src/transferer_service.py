@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import time
+import uuid
 import asyncio
 from typing import TYPE_CHECKING, Any
+from dataclasses import field, dataclass
+from collections.abc import Callable, Awaitable
 
 from autostars.src.ton import Wallet
 from autostars.src.logger import logger
@@ -11,6 +14,7 @@ from autostars.src.types.enums import (
     ErrorTypes,
     StarsOrderStatus as SOS,
 )
+from autostars.src.exceptions import OrderVersionConflict
 from autostars.src.fragment_api import FragmentAPI
 
 
@@ -22,8 +26,44 @@ if TYPE_CHECKING:
     from funpayhub.app.main import FunPayHub as FPH
 
 
+READY_ORDERS_LIMIT = 65
+CONFIRMATION_TIMEOUT = 60
+LEASE_DURATION = 120
+
+
+@dataclass
+class TransferBatch:
+    orders: list[StarsOrder]
+    transfers: dict[StarsOrder, Transfer] = field(default_factory=dict)
+    in_msg_hash: str | None = None
+    sent_at: float = 0
+
+    @property
+    def amount(self) -> int:
+        return sum(i.amount for i in self.transfers.values())
+
+
+_Stage = Callable[[TransferBatch], Awaitable[TransferBatch | None]]
+
+
 class TransferrerService:
-    def __init__(self, provider: AutostarsProvider, callbacks: Callbacks, show_sender: bool = False):
+    """
+    Конвейер: ссылки Fragment -> проверка баланса -> подпись и отправка -> подтверждение.
+
+    Пока одна пачка ждет подтверждения, следующая уже получает ссылки и проверяет баланс.
+    Подпись следующей пачки ждет, пока предыдущая не израсходует seqno кошелька.
+    """
+
+    def __init__(
+        self,
+        provider: AutostarsProvider,
+        callbacks: Callbacks,
+        show_sender: bool = False,
+        batch_window: float = 0.5,
+        retry_delay: float = 2,
+        fallback_interval: float = 30,
+        queue_size: int = 1,
+    ):
         self._provider = provider
         self._hub = callbacks.hub
         self._loop_stopped = False
@@ -31,8 +71,43 @@ class TransferrerService:
 
         self._stop = asyncio.Event()
         self._stopped = asyncio.Event()
+        self._orders_ready = asyncio.Event()
+        self._orders_ready.set()  # первый проход сразу проверяет базу
+
+        self._links_queue: asyncio.Queue[TransferBatch | None] = asyncio.Queue(queue_size)
+        self._planning_queue: asyncio.Queue[TransferBatch | None] = asyncio.Queue(queue_size)
+        self._sending_queue: asyncio.Queue[TransferBatch | None] = asyncio.Queue(queue_size)
+        self._confirmation_queue: asyncio.Queue[TransferBatch | None] = asyncio.Queue(queue_size)
+
+        self._seqno_released = asyncio.Event()
+        self._seqno_released.set()
+        self._reserved_amount = 0
+        self._leased: set[StarsOrder] = set()
+        # Владелец аренды - этот процесс, а не инстанс: у воркеров одного инстанса аренды разные.
+        self._lease_owner = uuid.uuid4().hex
 
         self.show_sender = show_sender
+        self.batch_window = batch_window
+        self.retry_delay = retry_delay
+        self.fallback_interval = fallback_interval
+
+    def notify(self) -> None:
+        """
+        Будит цикл сервиса: появились заказы, готовые к переводу.
+        """
+        self._orders_ready.set()
+
+    async def _wait_for_orders(self) -> None:
+        try:
+            await asyncio.wait_for(self._orders_ready.wait(), self.fallback_interval)
+        except TimeoutError:
+            logger.debug('Нет уведомлений о готовых заказах, проверяю базу данных.')
+            return
+
+        if not self._stop.is_set():
+            # Заказы из одной пачки событий приходят почти одновременно - собираем их вместе.
+            await asyncio.sleep(self.batch_window)
+        self._orders_ready.clear()
 
     async def main_loop(self) -> None:
         try:
@@ -44,71 +119,186 @@ class TransferrerService:
     async def _main_loop(self) -> None:
         logger.info('Autostars service запущен.')
         self._stopped.clear()
-        while True:
-            if self._stop.is_set():
-                self._stopped.set()
-                logger.info('Autostars service остановлен.')
-                return
 
-            await asyncio.sleep(2)
+        renew_task = asyncio.create_task(self._renew_leases_loop())
+        watch_task = asyncio.create_task(self._watch_changes())
+        try:
+            await self._run_pipeline()
+        finally:
+            renew_task.cancel()
+            watch_task.cancel()
+
+        self._stopped.set()
+        logger.info('Autostars service остановлен.')
+
+    async def _run_pipeline(self) -> None:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(
+                self._run_stage(self._links_queue, self._planning_queue, self.fetch_links),
+            )
+            tg.create_task(
+                self._run_stage(self._planning_queue, self._sending_queue, self.plan_transfer),
+            )
+            tg.create_task(
+                self._run_stage(self._sending_queue, self._confirmation_queue, self.send_transfer),
+            )
+            tg.create_task(
+                self._run_stage(self._confirmation_queue, None, self.confirm_transfer),
+            )
 
-            fragment_api = self.provider.fragment
-            wallet = self.provider.wallet
+            await self._claim_orders_loop()
+            await self._links_queue.put(None)
 
-            if fragment_api is None or wallet is None:
+    async def _claim_orders_loop(self) -> None:
+        while not self._stop.is_set():
+            await self._wait_for_orders()
+            if self._stop.is_set():
+                return
+
+            if self.provider.fragment is None or self.provider.wallet is None:
                 logger.warning('Fragment API или кошелек не указаны.')
                 continue
 
-            orders = (await self.provider.storage.get_ready_orders(self.hub.instance_id)).values()
+            # Заказы упавших воркеров переходят этому инстансу.
+            if await self.provider.storage.recover_expired_leases(self.hub.instance_id):
+                self.notify()
+
+            orders = list(
+                (
+                    await self.provider.storage.claim_ready_orders(
+                        self.hub.instance_id,
+                        self._lease_owner,
+                        LEASE_DURATION,
+                        READY_ORDERS_LIMIT,
+                    )
+                ).values(),
+            )
             if not orders:
                 logger.debug('Нет готовых для перевода заказов.')
                 continue
 
-            for i in orders:
-                i.retries_left -= 1
-            await self.provider.storage.add_or_update_orders(*orders)
-
-            logger.info('Начинаю перевод TON для заказов %s.', [i.order_id for i in orders])
-            await self.transfer(fragment_api, wallet, *orders)
+            if len(orders) >= READY_ORDERS_LIMIT:
+                self.notify()
 
-            errored, done = [i for i in orders if i.failed], [i for i in orders if i.done]
+            self._leased.update(orders)
 
-            if done:
-                asyncio.create_task(self.callbacks.on_successful_transaction(*done))
-            if errored:
-                asyncio.create_task(self.callbacks.on_transactions_error(*errored))
-
-    async def transfer(self, fragment: FragmentAPI, wallet: Wallet, *orders: StarsOrder) -> None:
-        tasks = await asyncio.gather(*(self.stars_link(fragment, i) for i in orders))
-        await self.provider.storage.add_or_update_orders(*orders)
+            logger.info('Начинаю перевод TON для заказов %s.', [i.order_id for i in orders])
+            await self._links_queue.put(TransferBatch(orders=orders))
 
-        orders_to_transfer = {i[0]: i[1] for i in tasks if i[1] is not None}
-        if not orders_to_transfer:
-            return
+    async def _renew_leases_loop(self) -> None:
+        while True:
+            await asyncio.sleep(LEASE_DURATION / 3)
+            if not self._leased:
+                continue
 
+            try:
+                await self.provider.storage.renew_leases(
+                    self._lease_owner,
+                    LEASE_DURATION,
+                    *(i.order_id for i in self._leased),
+                )
+            except Exception:
+                logger.warning('Ошибка продления аренды заказов.', exc_info=True)
+
+    async def _watch_changes(self) -> None:
+        # Заказ стал готовым к переводу - не ждем следующего опроса базы.
+        with self.provider.storage.changes.subscribe() as changes:
+            async for change in changes:
+                if change.new_status is SOS.READY:
+                    self.notify()
+
+    async def _run_stage(
+        self,
+        source: asyncio.Queue[TransferBatch | None],
+        target: asyncio.Queue[TransferBatch | None] | None,
+        stage: _Stage,
+    ) -> None:
+        while (batch := await source.get()) is not None:
+            batch = await stage(batch)
+            if batch is not None and target is not None:
+                await target.put(batch)
+
+        if target is not None:
+            await target.put(None)
+
+    async def fetch_links(self, batch: TransferBatch) -> TransferBatch | None:
+        fragment = self.provider.fragment
+        results = await asyncio.gather(*(self.stars_link(fragment, i) for i in batch.orders))
+        conflicts = await self.update_orders(*batch.orders, wait=True)
+
+        batch.transfers = {
+            order: transfer
+            for order, transfer in results
+            if transfer is not None and order.order_id not in conflicts
+        }
+        self._finish(*(order for order, transfer in results if transfer is None))
+        return batch if batch.transfers else None
+
+    async def plan_transfer(self, batch: TransferBatch) -> TransferBatch | None:
         try:
-            transferable_orders = await self.get_transferable_orders(orders_to_transfer, wallet)
+            transferable_orders = await self.get_transferable_orders(
+                batch.transfers,
+                self.provider.wallet,
+            )
         except Exception:
             logger.error('Ошибка получения баланса TON кошелька.', exc_info=True)
             await self.update_orders(
-                *orders_to_transfer.keys(),
+                *batch.transfers.keys(),
                 status=SOS.ERROR,
                 error=ErrorTypes.GET_BALANCE_ERROR,
             )
-            return
+            self._finish(*batch.transfers.keys())
+            return None
 
-        if err := (orders_to_transfer.keys() - transferable_orders.keys()):
+        if err := (batch.transfers.keys() - transferable_orders.keys()):
             await self.update_orders(
                 *err,
                 status=SOS.ERROR,
                 error=ErrorTypes.NOT_ENOUGH_TON,
                 retries_left=0,
             )
+            self._finish(*err)
 
         if not transferable_orders:
-            return
+            return None
 
-        await self.transfer_orders(wallet, transferable_orders)
+        batch.transfers = transferable_orders
+        self._reserved_amount += batch.amount
+        return batch
+
+    async def send_transfer(self, batch: TransferBatch) -> TransferBatch | None:
+        await self._seqno_released.wait()
+
+        if not await self.transfer_orders(self.provider.wallet, batch):
+            self._reserved_amount -= batch.amount
+            self._finish(*batch.transfers.keys())
+            return None
+
+        self._seqno_released.clear()
+        return batch
+
+    async def confirm_transfer(self, batch: TransferBatch) -> None:
+        orders = batch.transfers.keys()
+        try:
+            tr = await self.provider.tonapi.wait_for_transfer(
+                batch.in_msg_hash,
+                int(batch.sent_at + CONFIRMATION_TIMEOUT),
+            )
+        except TimeoutError:
+            logger.error('Таймаут ожидания транзакции с in_msg_hash=%s.', batch.in_msg_hash)
+            await self.update_orders(
+                *orders,
+                status=SOS.ERROR,
+                error=ErrorTypes.TRANSACTION_TIMEOUT_ERROR,
+            )
+        else:
+            logger.info('Перевел по заказам %s. Хэш: %s.', [i.order_id for i in orders], tr.hash)
+            await self.update_orders(*orders, status=SOS.DONE, transaction_hash=tr.hash)
+        finally:
+            self._reserved_amount -= batch.amount
+            self._seqno_released.set()
+
+        self._finish(*orders)
 
     async def stars_link(
         self,
@@ -125,14 +315,17 @@ class TransferrerService:
 
         o.ref, o.fragment_request_id = link.transaction.messages[0].clear_payload, req.request_id
 
-        return o, Transfer(
+        transfer = Transfer(
             address=link.transaction.messages[0].address,
             amount=link.transaction.messages[0].amount,
             body=await self.callbacks.gen_payload(o, link.transaction.messages[0].clear_payload),
             valid_until=link.transaction.valid_until,
         )
+        o.ton_amount = int(transfer.amount)
+        return o, transfer
 
-    async def transfer_orders(self, wallet: Wallet, orders: dict[StarsOrder, Transfer]) -> None:
+    async def transfer_orders(self, wallet: Wallet, batch: TransferBatch) -> bool:
+        orders = batch.transfers
         try:
             boc, in_hash = await wallet.create_external_transfer_message(*orders.values())
         except Exception:
@@ -142,41 +335,43 @@ class TransferrerService:
                 status=SOS.ERROR,
                 error=ErrorTypes.TRANSACTION_CREATION_ERROR,
             )
-            return
-
-        await self.update_orders(*orders.keys(), in_msg_hash=in_hash, status=SOS.TRANSFERRING)
-
-        try:
-            await self.provider.tonapi.send_message(boc)
-        except Exception:
-            logger.error('Ошибка перевода %s.', [i.order_id for i in orders], exc_info=True)
+            return False
+
+        if conflicts := await self.update_orders(
+            *orders.keys(),
+            in_msg_hash=in_hash,
+            status=SOS.TRANSFERRING,
+        ):
+            # Заказ изменили вне сервиса (например, пометили выполненным вручную), а сообщение
+            # уже подписано для всей пачки - не отправляем его, остальные заказы повторятся.
             await self.update_orders(
-                *orders.keys(),
+                *(i for i in orders if i.order_id not in conflicts),
                 status=SOS.ERROR,
                 error=ErrorTypes.TRANSFER_ERROR,
             )
-            return
+            return False
 
         try:
-            tr = await self.provider.wallet.wait_for_transfer(in_hash, int(time.time() + 60))
-        except TimeoutError:
-            logger.error('Таймаут ожидания транзакции с in_msg_hash=%s.', in_hash)
+            await self.provider.tonapi.send_message(boc)
+        except Exception:
+            logger.error('Ошибка перевода %s.', [i.order_id for i in orders], exc_info=True)
             await self.update_orders(
                 *orders.keys(),
                 status=SOS.ERROR,
-                error=ErrorTypes.TRANSACTION_TIMEOUT_ERROR,
+                error=ErrorTypes.TRANSFER_ERROR,
             )
-            return
+            return False
 
-        logger.info('Перевел по заказам %s. Хэш: %s.', [i.order_id for i in orders], tr.hash)
-        await self.update_orders(*orders.keys(), status=SOS.DONE, transaction_hash=tr.hash)
+        batch.in_msg_hash, batch.sent_at = in_hash, time.time()
+        return True
 
     async def get_transferable_orders(
         self,
         orders_dict: dict[StarsOrder, Transfer],
         wallet: Wallet,
     ) -> dict[StarsOrder, Transfer]:
-        balance = await wallet.get_balance() - int(0.1) * 1_000_000_000
+        # TON предыдущих пачек, которые еще не подтверждены, в балансе пока не учтены.
+        balance = await wallet.get_balance() - int(0.1) * 1_000_000_000 - self._reserved_amount
         transferable_orders: dict[StarsOrder, Transfer] = {}
         total = 0
         for order, transfer in sorted(orders_dict.items(), key=lambda x: x[1].amount):
@@ -187,17 +382,50 @@ class TransferrerService:
 
         return transferable_orders
 
-    async def update_orders(self, *orders: StarsOrder, save: bool = True, **kwargs: Any) -> None:
+    def _finish(self, *orders: StarsOrder) -> None:
+        self._leased.difference_update(orders)
+        errored, done = [i for i in orders if i.failed], [i for i in orders if i.done]
+
+        if done:
+            asyncio.create_task(self.callbacks.on_successful_transaction(*done))
+        if errored:
+            asyncio.create_task(self.callbacks.on_transactions_error(*errored))
+        if any(i.status is SOS.ERROR and i.retries_left > 0 for i in orders):
+            asyncio.get_running_loop().call_later(self.retry_delay, self.notify)
+
+    async def update_orders(
+        self,
+        *orders: StarsOrder,
+        save: bool = True,
+        wait: bool = False,
+        **kwargs: Any,
+    ) -> set[str]:
+        """
+        Изменяет поля заказов и сохраняет их.
+        Возвращает ID заказов, которые изменили вне сервиса: сервис их больше не обрабатывает.
+        Без `wait` (или сохранения статуса `TRANSFERRING`) изменения могут попасть в базу
+        позже, и конфликт тогда не вернется.
+        """
         for i in orders:
             for k, v in kwargs.items():
                 setattr(i, k, v)
 
-        if save:
-            await self.provider.storage.add_or_update_orders(*orders)
+        if not save:
+            return set()
+
+        try:
+            await self.provider.storage.update_dirty_orders(*orders, wait=wait)
+        except OrderVersionConflict as e:
+            logger.warning('Заказы %s изменены вне сервиса, обработка прекращена.', e.order_ids)
+            conflicts = set(e.order_ids)
+            self._leased.difference_update(i for i in orders if i.order_id in conflicts)
+            return conflicts
+        return set()
 
     async def stop(self) -> None:
         if not self._stop.is_set():
             self._stop.set()
+            self.notify()
         await self._stopped.wait()
 
     @property
@@ -1,3 +1,7 @@
 from __future__ import annotations
 
+from autostars.src.types.recipient import CachedRecipient
+from autostars.src.types.order_row import OrderRow
+from autostars.src.types.order_event import OrderEvent
 from autostars.src.types.stars_order import StarsOrder
+from autostars.src.types.sales_stats import SalesStats
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+
+__all__ = ['OrderEvent']
+
+
+from dataclasses import dataclass
+
+from .enums import ErrorTypes, StarsOrderStatus
+
+
+@dataclass
+class OrderEvent:
+    """
+    Смена статуса заказа.
+
+    `latency` - сколько секунд заказ провел в статусе `from_status`
+    (`None` для создания заказа и для заказов, сохраненных до появления журнала).
+    """
+
+    id: int
+    order_id: str
+    from_status: StarsOrderStatus | None
+    to_status: StarsOrderStatus
+    error: ErrorTypes | None
+    created_at: float
+    latency: float | None
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+
+__all__ = ['OrderRow', 'ORDER_COLUMNS']
+
+
+from typing import Any, ClassVar
+from functools import cache
+from collections.abc import Mapping
+
+from .enums import ErrorTypes, StarsOrderStatus
+
+
+# Колонки таблицы orders.
+ORDER_COLUMNS = (
+    'order_id',
+    'hub_instance',
+    'status',
+    'error',
+    'retries_left',
+    'stars_amount',
+    'ton_amount',
+    'funpay_chat_id',
+    'telegram_username',
+    'recipient_id',
+    'fragment_request_id',
+    'ref',
+    'in_msg_hash',
+    'transaction_hash',
+    'message_obj',
+    'order_preview',
+    'lease_owner',
+    'lease_expires_at',
+    'updated_at',
+    'version',
+)
+
+_CONVERTERS = {'status': StarsOrderStatus, 'error': ErrorTypes}
+
+
+class OrderRow:
+    """
+    Легкая запись заказа только с выбранными колонками, без валидации pydantic.
+    Только для чтения: чтобы изменить заказ, его нужно загрузить как `StarsOrder`.
+
+    Класс записи для набора колонок создается через `OrderRow.for_columns`.
+    JSON сообщения и превью заказа (если запрошены) остаются строками.
+    """
+
+    __slots__ = ()
+    columns: ClassVar[tuple[str, ...]] = ()
+
+    def __init__(self, row: Mapping[str, Any]) -> None:
+        for i in self.columns:
+            value = row[i]
+            if value is not None and i in _CONVERTERS:
+                value = _CONVERTERS[i](value)
+            object.__setattr__(self, i, value)
+
+    @classmethod
+    def for_columns(cls, columns: tuple[str, ...]) -> type[OrderRow]:
+        return _row_class(columns)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {i: getattr(self, i) for i in self.columns}
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'{type(self).__name__} is read-only.')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f'{type(self).__name__} is read-only.')
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, OrderRow):
+            return NotImplemented
+        return self.columns == other.columns and self.as_dict() == other.as_dict()
+
+    def __hash__(self) -> int:
+        return hash(tuple(getattr(self, i) for i in self.columns))
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{i}={getattr(self, i)!r}' for i in self.columns)
+        return f'{type(self).__name__}({fields})'
+
+
+@cache
+def _row_class(columns: tuple[str, ...]) -> type[OrderRow]:
+    if unknown := [i for i in columns if i not in ORDER_COLUMNS]:
+        raise ValueError(f'Unknown order columns: {", ".join(unknown)}.')
+    if len(set(columns)) != len(columns):
+        raise ValueError('Order columns must be unique.')
+    return type('OrderRow', (OrderRow,), {'__slots__': columns, 'columns': columns})
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+
+__all__ = ['CachedRecipient']
+
+
+import time
+from dataclasses import dataclass
+
+from .enums import ErrorTypes
+
+
+@dataclass
+class CachedRecipient:
+    username: str
+    recipient_id: str | None
+    error: ErrorTypes | None
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at <= time.time()
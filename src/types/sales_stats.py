@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+
+__all__ = ['SalesStats']
+
+
+from dataclasses import dataclass
+
+from .enums import StarsOrderStatus
+
+
+@dataclass
+class SalesStats:
+    """
+    Заказы, перешедшие в статус `status` за период, начинающийся с `period_start`
+    (unix timestamp, UTC). `ton_amount` - в nanoTON.
+    """
+
+    period_start: int
+    status: StarsOrderStatus
+    orders: int
+    stars_amount: int
+    ton_amount: int
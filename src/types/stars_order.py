@@ -5,13 +5,19 @@ __all__ = ['StarsOrder']
 
 
 import re
+from typing import Any
 
 from pydantic import (
     BaseModel,
     PrivateAttr,
+    ValidationInfo,
     ValidationError,
+    SerializationInfo,
+    ValidatorFunctionWrapHandler,
+    SerializerFunctionWrapHandler,
     computed_field,
     field_validator,
+    model_serializer,
     field_serializer,
 )
 from funpaybotengine.types import Message, OrderPreview
@@ -33,6 +39,14 @@ FULL_TITLE_RE = re.compile(
     r'(?:, (?P<telegram_username>.+$))?',
 )
 
+# Поля, которые хранятся в базе как JSON и не меняются после создания заказа.
+BLOB_FIELDS = ('message_obj', 'order_preview')
+# Колонки, которые вычисляются из JSON полей, но хранятся в базе отдельно.
+DERIVED_COLUMNS = ('order_id', 'funpay_chat_id', 'stars_amount')
+# Поля, которые заполняет база (триггерами) или хранилище, а не плагин.
+DB_MANAGED_FIELDS = ('updated_at', 'version')
+_BLOB_TYPES = {'message_obj': Message, 'order_preview': OrderPreview}
+
 
 class StarsOrder(BaseModel):
     model_config = {'extra': 'allow'}
@@ -49,24 +63,103 @@ class StarsOrder(BaseModel):
     status: StarsOrderStatus = StarsOrderStatus.UNPROCESSED
     error: ErrorTypes | None = None
     retries_left: int = 3
+    ton_amount: int | None = None  # nanoTON, которые ушли на перевод
+    lease_owner: str | None = None
+    lease_expires_at: float | None = None
+    updated_at: float | None = None
+    version: int = 0
 
     _sale_event: NewSaleEvent | None = PrivateAttr(default=None)
+    _raw_blobs: dict[str, str] = PrivateAttr(default_factory=dict)
+    _columns: dict[str, Any] = PrivateAttr(default_factory=dict)
+    _dirty: set[str] = PrivateAttr(default_factory=set)
+    _persisted: bool = PrivateAttr(default=False)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in self.__class__.model_fields:
+            self._dirty.add(name)
+        if name in BLOB_FIELDS:
+            self._raw_blobs.pop(name, None)
+            self._columns.clear()
+
+    def __getattr__(self, name: str) -> Any:
+        # JSON полей, загруженных из базы, разбирается только при первом обращении.
+        if name in BLOB_FIELDS and self.__pydantic_private__ is not None:
+            raw = self.__pydantic_private__['_raw_blobs'].get(name)
+            if raw is not None and name not in self.__dict__:
+                value = _BLOB_TYPES[name].model_validate_json(raw)
+                self.__dict__[name] = value
+                return value
+        return super().__getattr__(name)
+
+    @property
+    def dirty_fields(self) -> frozenset[str]:
+        """
+        Поля, измененные с момента загрузки из базы или последнего сохранения.
+        """
+        return frozenset(self._dirty)
+
+    @property
+    def persisted(self) -> bool:
+        return self._persisted
+
+    def mark_clean(self) -> None:
+        self._dirty.clear()
+        self._persisted = True
+
+    @model_serializer(mode='wrap')
+    def serialize_lazy_blobs(
+        self,
+        handler: SerializerFunctionWrapHandler,
+        info: SerializationInfo,
+    ) -> dict[str, Any]:
+        # Неразобранные JSON поля нет в __dict__, и pydantic их не видит: разбираем перед дампом.
+        for i in BLOB_FIELDS:
+            if i in self.__dict__ or i in (info.exclude or ()):
+                continue
+            if info.include is None or i in info.include:
+                getattr(self, i)
+        data = handler(self)
+        if self._raw_blobs:
+            # Разобранные поля оказываются в конце __dict__: возвращаем полям порядок модели.
+            fields = self.__class__.model_fields
+            data = {**{i: data[i] for i in fields if i in data}, **data}
+        return data
 
     @field_serializer('message_obj', mode='plain')
     def serialize_message(self, v: Message) -> str:
         return v.model_dump_json()
 
-    @field_validator('message_obj', mode='before')
-    def deserialize_message(cls, v: str | Message) -> Message:
-        return Message.model_validate_json(v) if isinstance(v, str) else v
+    @field_validator('message_obj', mode='wrap')
+    def deserialize_message(
+        cls,
+        v: str | Message,
+        handler: ValidatorFunctionWrapHandler,
+        info: ValidationInfo,
+    ) -> Message | str:
+        if isinstance(v, str):
+            return v if cls._is_lazy(info) else Message.model_validate_json(v)
+        return handler(v)
 
     @field_serializer('order_preview', mode='plain')
     def serialize_order_preview(self, v: OrderPreview) -> str | None:
         return v.model_dump_json()
 
-    @field_validator('order_preview', mode='before')
-    def deserialize_order_preview(cls, v: str | OrderPreview) -> OrderPreview:
-        return OrderPreview.model_validate_json(v) if isinstance(v, str) else v
+    @field_validator('order_preview', mode='wrap')
+    def deserialize_order_preview(
+        cls,
+        v: str | OrderPreview,
+        handler: ValidatorFunctionWrapHandler,
+        info: ValidationInfo,
+    ) -> OrderPreview | str:
+        if isinstance(v, str):
+            return v if cls._is_lazy(info) else OrderPreview.model_validate_json(v)
+        return handler(v)
+
+    @staticmethod
+    def _is_lazy(info: ValidationInfo) -> bool:
+        return bool(info.context and info.context.get('lazy_blobs'))
 
     @field_validator('telegram_username', mode='before')
     def remove_at_from_username(cls, v: str | None) -> str | None:
@@ -77,11 +170,15 @@ class StarsOrder(BaseModel):
     @computed_field
     @property
     def order_id(self) -> str:
+        if (order_id := self._columns.get('order_id')) is not None:
+            return order_id
         return self.order_preview.id
 
     @computed_field
     @property
     def funpay_chat_id(self) -> int:
+        if (chat_id := self._columns.get('funpay_chat_id')) is not None:
+            return chat_id
         return self.message_obj.chat_id
 
     @property
@@ -107,6 +204,16 @@ class StarsOrder(BaseModel):
             self._sale_event._order_preview = self.order_preview
         return self._sale_event
 
+    @staticmethod
+    def parse_stars_amount(order_title: str) -> int | None:
+        """
+        Общее кол-во звезд по названию лота или `None`, если его не удалось определить.
+        """
+        if not (match := STARS_AMOUNT_RE.search(order_title)):
+            return None
+        pcs = PCS_RE.search(order_title)
+        return int(match.group(1)) * (int(pcs.group(1)) if pcs else 1)
+
     @property
     def order_stars_amount(self) -> int:
         try:
@@ -149,5 +256,45 @@ class StarsOrder(BaseModel):
             hub_instance=hub_instance,
         )
 
+    @classmethod
+    def from_row(cls, row: Any) -> StarsOrder:
+        """
+        Создает заказ из строки базы данных.
+        JSON сообщения и превью заказа не разбирается, пока к ним не обратятся.
+        """
+        data = dict(row)
+        columns = {i: data.pop(i) for i in DERIVED_COLUMNS if i in data}
+        order = cls.model_validate(data, context={'lazy_blobs': True})
+        for i in BLOB_FIELDS:
+            if isinstance(order.__dict__[i], str):
+                order._raw_blobs[i] = order.__dict__.pop(i)
+        order._columns = columns
+        order.mark_clean()
+        return order
+
+    def to_row(self) -> dict[str, Any]:
+        """
+        Данные для записи в базу.
+        JSON неизменяемых полей сериализуется один раз и переиспользуется при следующих записях.
+        """
+        data = self.model_dump(mode='json', exclude={*BLOB_FIELDS, *DB_MANAGED_FIELDS})
+        for i in BLOB_FIELDS:
+            if i not in self._raw_blobs:
+                self._raw_blobs[i] = getattr(self, i).model_dump_json()
+            data[i] = self._raw_blobs[i]
+        data['stars_amount'] = self._columns.get('stars_amount')
+        if data['stars_amount'] is None:
+            data['stars_amount'] = self.parse_stars_amount(self.order_preview.title)
+        return data
+
+    def dirty_row(self) -> dict[str, Any]:
+        """
+        Измененные колонки для частичного UPDATE. Неизменяемые JSON поля сюда не попадают.
+        """
+        return self.model_dump(
+            mode='json',
+            include=self._dirty - {*BLOB_FIELDS, *DB_MANAGED_FIELDS},
+        )
+
     def __hash__(self):
         return id(self)
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import pytest
+
+from autostars.test import fake_event
+from autostars.src.types import StarsOrder
+
+
+@pytest.fixture
+def order() -> StarsOrder:
+    event = fake_event(telegram_username='stars_buyer', amount=100, pcs=2)
+    return StarsOrder.from_objects(event.message, event._order_preview, 'instance')
+
+
+def test_stored_order_dump_includes_blobs(order: StarsOrder) -> None:
+    stored = StarsOrder.from_row(order.to_row())
+
+    assert stored.model_dump() == order.model_dump()
+    assert stored.model_dump_json() == order.model_dump_json()
+    restored = StarsOrder.model_validate_json(stored.model_dump_json())
+    assert restored.model_dump() == order.model_dump()
+
+
+def test_stored_order_dump_respects_exclude(order: StarsOrder) -> None:
+    stored = StarsOrder.from_row(order.to_row())
+
+    data = stored.model_dump(exclude={'message_obj'})
+    assert 'message_obj' not in data
+    assert data['order_preview'] == order.model_dump()['order_preview']
+    assert 'message_obj' not in stored.__dict__